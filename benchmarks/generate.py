@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Generate a synthetic Serato library, a 'database V2' file and crates,
+for benchmarking. The output only depends on the options and the
+seed, so runs are comparable.
+
+    python benchmarks/generate.py --tracks 100000 /tmp/_Serato_
+"""
+
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# pylint: disable=wrong-import-position
+import scratchlivedb
+from scratchlivedb import scratchdb
+
+# pylint: disable=protected-access
+# Ignore 'Access to protected member'
+
+ARTISTS = [
+    "Amon Tobin", "Björk", "Sigur Rós", "Mötley Crüe", "Daft Punk",
+    "坂本龍一", "Мумий Тролль", "Noisia", "DJ Shadow", "Beyoncé",
+    "Café Tacvba", "Ólafur Arnalds", "Łona", "Sub Focus", "Röyksopp",
+    "Señor Coconut", "ゆらゆら帝国", "Ensiferum", "Jurassic 5", "ДДТ",
+]
+WORDS = [
+    "Night", "Drive", "Ünder", "Light", "Café", "Strøm", "Dub", "Ghost",
+    "Ритм", "夜", "Échos", "Motion", "Bass", "Señal", "Delta", "Zürich",
+]
+GENRES = ["Drum & Bass", "House", "Hip-Hop", "Techno", "Électro", "Rock"]
+KEYS = ["1A", "2A", "3B", "8A", "8B", "11A", "12B"]
+EXTENSIONS = ["mp3", "mp3", "mp3", "m4a", "flac", "wav"]
+COLUMNS = ["song", "artist", "album", "length", "bpm", "key", "added"]
+
+
+def _field(key, raw):
+    return key.encode("utf-8") + scratchdb._int2hexbin(len(raw)) + raw
+
+
+def _text(key, val):
+    return _field(key, scratchdb._str_to_slstr(val))
+
+
+def _record(name, fields):
+    data = b"".join(fields)
+    return name.encode("utf-8") + scratchdb._int2hexbin(len(data)) + data
+
+
+def _words(rand, count):
+    return " ".join(rand.choice(WORDS) for _ in range(count))
+
+
+def _track(rand, idx):
+    """
+    Return (path, encoded otrk record) for track number 'idx'. Every
+    track has the fields Serato needs, the rest are set at random so
+    entries vary in size and field set like a real library.
+    """
+    artist = rand.choice(ARTISTS)
+    album = _words(rand, rand.randint(1, 3))
+    title = _words(rand, rand.randint(1, 4))
+    ext = rand.choice(EXTENSIONS)
+    path = "music/%s/%s/%02d - %s %d.%s" % (
+            artist, album, rand.randint(1, 20), title, idx, ext)
+    added = 1300000000 + idx * 60
+
+    fields = [
+        _text("ttyp", ext),
+        _text("pfil", path),
+        _text("tsng", title),
+        _text("tart", artist),
+    ]
+    optional = [
+        (0.9, lambda: _text("talb", album)),
+        (0.8, lambda: _text("tgen", rand.choice(GENRES))),
+        (0.7, lambda: _text("tbpm", "%d.%02d" % (rand.randint(70, 180),
+                                                 rand.randint(0, 99)))),
+        (0.6, lambda: _text("tkey", rand.choice(KEYS))),
+        (0.9, lambda: _text("tlen", "%02d:%02d.%02d" % (
+                rand.randint(1, 12), rand.randint(0, 59),
+                rand.randint(0, 99)))),
+        (0.9, lambda: _text("tbit", "%dkbps" % rand.choice([192, 256, 320]))),
+        (0.9, lambda: _text("tsmp", "44.1k")),
+        (0.9, lambda: _text("tsiz", "%.1fMB" % rand.uniform(2, 20))),
+        (0.3, lambda: _text("tcom", _words(rand, rand.randint(1, 8)))),
+        (0.2, lambda: _text("ttyr", str(rand.randint(1960, 2020)))),
+        (0.9, lambda: _text("tadd", str(added))),
+        (0.2, lambda: _field("ulbl", scratchdb._int2hexbin(
+                rand.choice([0, 0xff0000, 0x00ff00])))),
+        (0.9, lambda: _field("ufsb", scratchdb._int2hexbin(
+                rand.randint(2000000, 20000000)))),
+        (0.3, lambda: _field("utkn", scratchdb._int2hexbin(
+                rand.randint(1, 20)))),
+    ]
+    for chance, make in optional:
+        if rand.random() < chance:
+            fields.append(make())
+
+    fields += [
+        _field("uadd", scratchdb._int2hexbin(added)),
+        _field("utme", scratchdb._int2hexbin(added + rand.randint(0, 999))),
+        _field("bhrt", b"\x01"),
+        _field("bmis", b"\x00"),
+        _field("bply", bytes([rand.random() < 0.3])),
+        _field("sbav", b"\x00\x00"),
+    ]
+    return path, _record("otrk", fields)
+
+
+def build_database(filename, tracks, seed=0):
+    """
+    Write a database with 'tracks' tracks to 'filename'. Returns the
+    list of track paths.
+    """
+    rand = random.Random(seed)
+    paths = []
+    with open(filename, "wb") as f:
+        f.write(scratchlivedb.ScratchDatabase._header_bytes())
+        for idx in range(tracks):
+            path, record = _track(rand, idx)
+            paths.append(path)
+            f.write(record)
+    return paths
+
+
+def build_crate(filename, paths, tracks, seed=0):
+    """
+    Write a crate with 'tracks' tracks picked from 'paths', after the
+    sort column and visible column records
+    """
+    rand = random.Random(seed)
+    with open(filename, "wb") as f:
+        f.write(scratchlivedb.ScratchCrate._header_bytes())
+        f.write(_record("osrt", [_text("tvcn", rand.choice(COLUMNS)),
+                                 _field("brev", b"\x00")]))
+        for column in COLUMNS:
+            f.write(_record("ovct", [_text("tvcn", column),
+                                     _text("tvcw", str(rand.randint(0, 600)))]))
+        for path in rand.sample(paths, min(tracks, len(paths))):
+            f.write(_record("otrk", [_text("ptrk", path)]))
+
+
+def build_library(dirname, tracks, crates=10, seed=0):
+    """
+    Write a '_Serato_' style folder to 'dirname', with a database of
+    'tracks' tracks and 'crates' crates that each hold a tenth of them
+    """
+    subcrates = os.path.join(dirname, "Subcrates")
+    os.makedirs(subcrates, exist_ok=True)
+    paths = build_database(os.path.join(dirname, "database V2"),
+                           tracks, seed)
+    for idx in range(crates):
+        build_crate(os.path.join(subcrates, "Crate %d.crate" % idx),
+                    paths, max(1, tracks // 10), seed + idx + 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("dirname", help="Library folder to write")
+    parser.add_argument("--tracks", type=int, default=10000,
+                        help="Number of tracks in the database")
+    parser.add_argument("--crates", type=int, default=10,
+                        help="Number of crates")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Random seed")
+    options = parser.parse_args()
+    build_library(options.dirname, options.tracks,
+                  options.crates, options.seed)
+
+
+if __name__ == "__main__":
+    main()
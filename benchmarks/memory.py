@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Measure the memory overhead per entry of loading a database, for the
+different load modes. The file content itself is left out, so the
+numbers are what the entry objects cost on top of the raw bytes.
+
+    python benchmarks/memory.py --tracks 80000
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+# pylint: disable=wrong-import-position
+import generate
+import scratchlivedb
+
+
+def _property_names(cls):
+    """
+    Return the names of every field property of record class 'cls'
+    """
+    return sorted(name for klass in cls.__mro__
+                  for name, value in vars(klass).items()
+                  if isinstance(value, property))
+
+
+def measure(filename, count, touch=False, **kwargs):
+    """
+    Return the bytes allocated per entry by loading 'filename' with
+    the 'kwargs' load options, not counting the file content. With
+    'touch', every field property of every entry is read first.
+    """
+    tracemalloc.start()
+    db = scratchlivedb.ScratchDatabase(filename, **kwargs)
+    if touch:
+        names = {}
+        for entry in db.entries:
+            cls = type(entry)
+            if cls not in names:
+                names[cls] = _property_names(cls)
+            for name in names[cls]:
+                getattr(entry, name)
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    if not kwargs.get("mmap"):
+        used -= os.path.getsize(filename)
+    assert len(db.entries) == count
+    db.close()
+    return used // count
+
+
+MODES = [
+    ("eager", {}),
+    ("lazy", {"lazy": True}),
+    ("lazy, all fields read", {"lazy": True, "touch": True}),
+    ("same, no decode cache", {"lazy": True, "touch": True,
+                               "decode_cache": False}),
+    ("lazy + mmap", {"lazy": True, "mmap": True}),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--tracks", type=int, default=20000,
+                        help="Number of tracks in the database")
+    parser.add_argument("--json", action="store_true",
+                        help="Print the results as JSON")
+    options = parser.parse_args()
+
+    fd, filename = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        generate.build_database(filename, options.tracks)
+        results = dict((name, measure(filename, options.tracks, **kwargs))
+                       for name, kwargs in MODES)
+    finally:
+        os.unlink(filename)
+
+    if options.json:
+        print(json.dumps({"tracks": options.tracks,
+                          "bytes_per_entry": results}, indent=2))
+        return
+    for name, _ in MODES:
+        print("%-24s: %6d bytes/entry" % (name, results[name]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Time and measure the memory of the main operations on synthetic
+databases and crates of each requested size, and print the results
+as JSON so they can be compared between runs.
+
+    python benchmarks/run.py --tracks 10000 100000 --output results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+# pylint: disable=wrong-import-position
+import generate
+import scratchlivedb
+
+
+def _properties(obj):
+    return [name for name in dir(obj.__class__)
+            if isinstance(getattr(obj.__class__, name), property)]
+
+
+def _read_all(scratchfile):
+    for entry in scratchfile.entries:
+        for name in _properties(entry):
+            getattr(entry, name)
+
+
+def _modify(scratchfile):
+    if isinstance(scratchfile, scratchlivedb.ScratchCrate):
+        for entry in scratchfile.tracks:
+            entry.filetrack = "/" + entry.filetrack
+    else:
+        for entry in scratchfile.entries:
+            entry.trackcomment = "benchmark"
+
+
+def _phases(cls, filename, outname, options):
+    """
+    Return the list of (phase name, function) to run in order. Each
+    function gets the result of the previous one.
+    """
+    return [
+        ("parse", lambda _: cls(filename, **options)),
+        ("read", lambda db: _read_all(db) or db),
+        ("modify", lambda db: _modify(db) or db),
+        ("serialize", lambda db: db.get_final_content() and db),
+        ("save", lambda db: db.save(outname) or db),
+    ]
+
+
+def _run(cls, filename, outname, options, trace):
+    """
+    Run every phase, and return {phase: seconds}, or {phase: peak
+    bytes allocated} if 'trace' is set. Timings aren't taken while
+    tracing, tracemalloc slows everything down.
+    """
+    ret = {}
+    val = None
+    if trace:
+        tracemalloc.start()
+    for phase, func in _phases(cls, filename, outname, options):
+        if trace:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            val = func(val)
+            ret[phase] = tracemalloc.get_traced_memory()[1] - base
+        else:
+            start = time.perf_counter()
+            val = func(val)
+            ret[phase] = time.perf_counter() - start
+    if trace:
+        tracemalloc.stop()
+    val.close()
+    return ret
+
+
+MODES = {
+    "eager": {},
+    "lazy": {"lazy": True},
+}
+
+
+def benchmark(tracks, modes, workdir):
+    """
+    Return a list of result dicts, one per file kind, mode and phase,
+    for a library of 'tracks' tracks
+    """
+    dbfile = os.path.join(workdir, "database V2")
+    cratefile = os.path.join(workdir, "bench.crate")
+    paths = generate.build_database(dbfile, tracks)
+    generate.build_crate(cratefile, paths, tracks)
+
+    results = []
+    for kind, cls, filename in [
+            ("database", scratchlivedb.ScratchDatabase, dbfile),
+            ("crate", scratchlivedb.ScratchCrate, cratefile)]:
+        outname = filename + ".out"
+        for mode in modes:
+            seconds = _run(cls, filename, outname, MODES[mode], False)
+            peaks = _run(cls, filename, outname, MODES[mode], True)
+            for phase in seconds:
+                results.append({
+                    "kind": kind,
+                    "tracks": tracks,
+                    "filesize": os.path.getsize(filename),
+                    "mode": mode,
+                    "phase": phase,
+                    "seconds": round(seconds[phase], 6),
+                    "peak_bytes": peaks[phase],
+                })
+        os.unlink(outname)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--tracks", type=int, nargs="+", default=[10000],
+                        help="Library sizes to benchmark")
+    parser.add_argument("--mode", choices=sorted(MODES), action="append",
+                        help="Load modes to benchmark, default all")
+    parser.add_argument("--output",
+                        help="Write the JSON results to this file")
+    options = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="scratchlivedb-bench-")
+    try:
+        results = []
+        for tracks in options.tracks:
+            results += benchmark(tracks, options.mode or sorted(MODES),
+                                 workdir)
+    finally:
+        shutil.rmtree(workdir)
+
+    data = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    out = json.dumps(data, indent=2)
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(out + "\n")
+    else:
+        print(out)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,13 @@
-
 from scratchlivedb.scratchdb import (ScratchParseError,
                                      ScratchCrate,
                                      ScratchDatabase)
+from scratchlivedb.compare import diff, merge, ScratchDiff, ScratchMerge
+from scratchlivedb.fsck import validate, ValidationReport
+from scratchlivedb.library import SeratoLibrary
+from scratchlivedb.profiling import Profile
+from scratchlivedb.stats import LibraryStats
 
 # This describes the public API
-__all__ = ["ScratchParseError", "ScratchCrate", "ScratchDatabase"]
+__all__ = ["ScratchParseError", "ScratchCrate", "ScratchDatabase",
+           "SeratoLibrary", "Profile", "validate", "ValidationReport",
+           "diff", "merge", "ScratchDiff", "ScratchMerge", "LibraryStats"]
@@ -1,8 +1,12 @@
 import argparse
+import json
 import logging
+import os
 import sys
 
 import scratchlivedb
+from scratchlivedb import export
+from scratchlivedb import sqlite
 
 log = logging.getLogger("scratchlivedb")
 log.setLevel(logging.DEBUG)
@@ -35,28 +39,272 @@ def setup_logging(debug):
 def parse_options():
     desc = "Command line tool for interacting with scratchlive databases"
     parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument("--debug", action="store_true",
+            help="Print debug output to stderr")
+    parser.add_argument("--profile", action="store_true",
+            help="Print timings of each load and save phase to stderr")
     subparsers = parser.add_subparsers(dest="command")
     subparsers.required = True
 
-    parser.add_argument("scratchlivedbfile",
-            help="Path to scratchlive db file ex. /path/to/database V2")
-    parser.add_argument("--debug", action="store_true",
-            help="Print debug output to stderr")
+    dumpdesc = ("Dump fields of the tracks in database and crate files, "
+                "by default their paths. Output is streamed as the files "
+                "are read.")
+    dump = subparsers.add_parser("dump", description=dumpdesc)
+    dump.add_argument("scratchlivefiles", nargs="+",
+            metavar="scratchlivefile",
+            help="Path to scratchlive db or crate file "
+                 "ex. /path/to/database V2")
+    dump.add_argument("--fields", default="path",
+            help="Comma separated fields to print, field keys like tart "
+                 "or tbpm, 'path' for the track path and 'file' for the "
+                 "file it's from. Default is 'path'")
+    dump.add_argument("--format", choices=export.FORMATS, default="text",
+            help="Output format. 'text' is tab separated without a "
+                 "header line. Default is 'text'")
+    dump.add_argument("--where", action="append", default=[],
+            metavar="FILTER",
+            help="Only dump tracks matching FILTER, ex. 'tart=Noisia', "
+                 "'tbpm>=170' or 'path~remix'. Can be passed multiple "
+                 "times, tracks must match all of them")
+
+    sqlitedesc = ("Export database and crate files to an SQLite file. "
+                  "If the SQLite file exists, only changes are synced.")
+    exportsqlite = subparsers.add_parser("export-sqlite",
+                                         description=sqlitedesc)
+    exportsqlite.add_argument("sqlitefile",
+            help="Path to the SQLite file to create or update")
+    exportsqlite.add_argument("scratchlivefiles", nargs="+",
+            metavar="scratchlivefile",
+            help="Database or crate files to export")
+
+    relocatedesc = ("Change the start of every track path in a Serato "
+                    "library folder, the database and all crates")
+    relocate = subparsers.add_parser("relocate", description=relocatedesc)
+    relocate.add_argument("seratodir",
+            help="Path to the library folder ex. /path/to/_Serato_")
+    relocate.add_argument("old_prefix",
+            help="Path prefix to replace, ex. Volumes/OldDrive/music")
+    relocate.add_argument("new_prefix",
+            help="Path prefix to use instead")
+    relocate.add_argument("--backups", type=int, default=1,
+            help="Number of backup copies of each changed file to keep")
+
+    fsckdesc = ("Check the structure of database and crate files, and "
+                "report every problem found")
+    fsck = subparsers.add_parser("fsck", description=fsckdesc)
+    fsck.add_argument("scratchlivefiles", nargs="+",
+            metavar="scratchlivefile",
+            help="Database or crate files to check")
+    fsck.add_argument("--salvage", metavar="OUTFILE",
+            help="Write the valid entries of the file to OUTFILE. "
+                 "Only one file can be checked with this option.")
+
+    diffdesc = ("Show the entries added, removed and changed between "
+                "two snapshots of a database or crate")
+    diff = subparsers.add_parser("diff", description=diffdesc)
+    diff.add_argument("oldfile", help="Older database or crate file")
+    diff.add_argument("newfile", help="Newer database or crate file")
+
+    mergedesc = ("Three-way merge of two snapshots of a database or "
+                 "crate that started out as the same base file")
+    merge = subparsers.add_parser("merge", description=mergedesc)
+    merge.add_argument("basefile", help="Common base database or crate")
+    merge.add_argument("ourfile", help="Our changed copy")
+    merge.add_argument("theirfile", help="Their changed copy")
+    merge.add_argument("-o", "--output", required=True,
+            help="File to write the merged result to")
+
+    dedupedesc = ("Report groups of duplicate tracks in a database or "
+                  "crate, and optionally write a copy with each group "
+                  "collapsed to its best populated track")
+    dedupe = subparsers.add_parser("dedupe", description=dedupedesc)
+    dedupe.add_argument("scratchlivefile",
+            help="Database or crate file to check")
+    dedupe.add_argument("--keys",
+            help="Comma separated field keys that duplicates share, "
+                 "ex. ufsb,tart,tsng. Default is the track path")
+    dedupe.add_argument("-o", "--output",
+            help="Write the deduplicated file to OUTPUT")
+
+    statsdesc = ("Report track counts by type, key, BPM and month added, "
+                 "total size, and missing and corrupt tracks, for a "
+                 "database or crate file, or for the database and every "
+                 "crate of a Serato library folder")
+    stats = subparsers.add_parser("stats", description=statsdesc)
+    stats.add_argument("path",
+            help="Database or crate file, or library folder "
+                 "ex. /path/to/_Serato_")
+    stats.add_argument("--json", action="store_true",
+            help="Print the numbers as JSON")
+
+    options = parser.parse_args()
+    if options.command == "dump":
+        try:
+            options.fields = options.fields.split(",")
+            for field in options.fields:
+                export.check_field(field)
+            options.where = [export.parse_filter(expr)
+                             for expr in options.where]
+        except ValueError as e:
+            parser.error(str(e))
+    if (options.command == "fsck" and options.salvage and
+        len(options.scratchlivefiles) > 1):
+        parser.error("--salvage only works with a single file")
+    return options
+
+
+def _load_file(filename, options):
+    # pylint: disable=protected-access
+    # Ignore 'Access to protected member'
+    cls = scratchlivedb.scratchdb._file_class(filename)
+    return cls(filename, lazy=True, profile=options.profile)
+
+
+def _cmd_dump(options):
+    rows = export.iter_rows(options.scratchlivefiles, options.fields,
+                           options.where, track_unknowns=True,
+                           profile=options.profile)
+    try:
+        export.write_rows(sys.stdout, rows, options.fields, options.format)
+        sys.stdout.flush()
+    except BrokenPipeError:
+        # Piped into something like 'head' that exited early. Point
+        # stdout at devnull so the flush at exit doesn't fail again.
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+
+
+def _cmd_export_sqlite(options):
+    scratchfiles = [_load_file(f, options) for f in options.scratchlivefiles]
+    counts = sqlite.export_sqlite(options.sqlitefile, scratchfiles)
+    print("Inserted %(inserted)d, updated %(updated)d, "
+          "deleted %(deleted)d, unchanged %(unchanged)d entries" % counts)
 
-    dumpdesc = "Dump the database file paths"
-    subparsers.add_parser("dump", description=dumpdesc)
 
-    return parser.parse_args()
+def _cmd_relocate(options):
+    with scratchlivedb.SeratoLibrary(options.seratodir, lazy=True,
+                                     profile=options.profile) as library:
+        counts = library.relocate(options.old_prefix, options.new_prefix,
+                                  backups=options.backups)
+    for filename, count in counts.items():
+        if count:
+            print("%s: %d entries" % (filename, count))
+    print("Relocated %d entries in %d files" %
+          (sum(counts.values()), len([c for c in counts.values() if c])))
+
+
+def _cmd_fsck(options):
+    ret = 0
+    for filename in options.scratchlivefiles:
+        report = scratchlivedb.validate(filename, salvage=options.salvage)
+        for offset, msg in report.errors:
+            print("%s: offset %d: %s" % (filename, offset, msg))
+        print("%s: %s, %d valid entries, %d errors" %
+              (filename, report.filetype or "unknown file type",
+               report.entries, len(report.errors)))
+        if report.salvaged is not None:
+            print("Wrote %d entries to %s" %
+                  (report.salvaged, options.salvage))
+        if not report.ok:
+            ret = 1
+    return ret
+
+
+def _load_same_type(filenames, options):
+    scratchfiles = [_load_file(f, options) for f in filenames]
+    if len(set(type(f) for f in scratchfiles)) != 1:
+        raise RuntimeError("Files must all be databases or all be crates")
+    return scratchfiles
+
+
+def _cmd_diff(options):
+    old, new = _load_same_type([options.oldfile, options.newfile], options)
+    result = scratchlivedb.diff(old, new)
+    sys.stdout.write(result.format())
+    print("%d added, %d removed, %d changed" %
+          (len(result.added), len(result.removed), len(result.changed)))
+    return 1 if result else 0
+
+
+def _cmd_merge(options):
+    base, ours, theirs = _load_same_type(
+            [options.basefile, options.ourfile, options.theirfile], options)
+    result = scratchlivedb.merge(base, ours, theirs)
+    for path, key, baseval, ourval, theirval in result.conflicts:
+        print("Conflict %s %s: base=%r ours=%r theirs=%r (kept ours)" %
+              (path, key or "entry", baseval, ourval, theirval))
+
+    ours.entries = result.entries
+    ours.save(options.output)
+    print("Wrote %d entries to %s, %d conflicts" %
+          (len(result.entries), options.output, len(result.conflicts)))
+    return 1 if result.conflicts else 0
+
+
+def _cmd_dedupe(options):
+    # pylint: disable=protected-access
+    # Ignore 'Access to protected member'
+    scratchfile = _load_file(options.scratchlivefile, options)
+    keys = options.keys and options.keys.split(",")
+    groups = scratchfile.find_duplicates(keys)
+    for group in groups:
+        print("* %s" % scratchfile._entry_path(group[0]))
+        for entry in group[1:]:
+            print("  %s" % scratchfile._entry_path(entry))
+    print("%d duplicate groups, %d duplicate tracks" %
+          (len(groups), sum(len(group) - 1 for group in groups)))
+
+    if not options.output:
+        return 1 if groups else 0
+    removed = scratchfile.dedupe(keys)
+    scratchfile.save(options.output)
+    print("Removed %d tracks, wrote %d entries to %s" %
+          (removed, len(scratchfile.entries), options.output))
+    return 0
+
+
+def _cmd_stats(options):
+    if os.path.isdir(options.path):
+        with scratchlivedb.SeratoLibrary(options.path, lazy=True,
+                                         profile=options.profile) as library:
+            results = library.stats()
+    else:
+        scratchfile = _load_file(options.path, options)
+        results = {options.path: scratchfile.stats()}
+
+    if options.json:
+        print(json.dumps(dict((filename, stats.as_dict())
+                              for filename, stats in results.items()),
+                         indent=2, sort_keys=True))
+        return
+    for filename, stats in results.items():
+        print("%s:" % filename)
+        sys.stdout.write(stats.report())
 
 
 def main():
     options = parse_options()
     setup_logging(options.debug)
-    dbfile = options.scratchlivedbfile
-    db = scratchlivedb.ScratchDatabase(dbfile)
+    options.profile = options.profile and scratchlivedb.Profile()
+    ret = 0
 
     if options.command == "dump":
-        for entry in db.entries:
-            print(entry.filebase)
+        _cmd_dump(options)
+    elif options.command == "export-sqlite":
+        _cmd_export_sqlite(options)
+    elif options.command == "relocate":
+        _cmd_relocate(options)
+    elif options.command == "fsck":
+        ret = _cmd_fsck(options)
+    elif options.command == "diff":
+        ret = _cmd_diff(options)
+    elif options.command == "merge":
+        ret = _cmd_merge(options)
+    elif options.command == "dedupe":
+        ret = _cmd_dedupe(options)
+    elif options.command == "stats":
+        _cmd_stats(options)
 
-    return 0
+    if options.profile:
+        sys.stderr.write(options.profile.report())
+    return ret
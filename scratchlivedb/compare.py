@@ -0,0 +1,229 @@
+import collections
+
+from scratchlivedb import scratchdb
+
+# pylint: disable=protected-access
+# Ignore 'Access to protected member'
+
+
+def _entry_key(scratchfile, entry, ordinals):
+    """
+    Return the key that pairs 'entry' with its counterpart in another
+    snapshot: the record name, normalized track path, and how many
+    entries with the same name and path came before it
+    """
+    name_path = (entry._name, scratchfile._entry_path(entry))
+    ordinal = ordinals[name_path]
+    ordinals[name_path] += 1
+    return name_path + (ordinal,)
+
+
+def _keyed_entries(scratchfile):
+    """
+    Return an ordered dict of {pairing key: entry}
+    """
+    ordinals = collections.Counter()
+    return collections.OrderedDict(
+            (_entry_key(scratchfile, entry, ordinals), entry)
+            for entry in scratchfile.entries)
+
+
+def _entry_bytes(entry):
+    """
+    Return the encoded entry, without copying it if it's unmodified
+    """
+    if entry._span_is_current():
+        return memoryview(entry._content)[entry._start:entry._end]
+    return entry.get_final_content()
+
+
+def _decode(key, rawval):
+    if rawval is None:
+        return None
+    try:
+        return scratchdb._get_converter(key, rawval,
+                                        scratchdb._key_to_type(key))
+    except (RuntimeError, ValueError):
+        return rawval
+
+
+def _changed_fields(oldentry, newentry):
+    """
+    Return {key: (old value, new value)} for every field that differs
+    between the entries. Only those fields are decoded.
+    """
+    oldfields = dict(oldentry._iter_raw_fields())
+    newfields = dict(newentry._iter_raw_fields())
+    ret = collections.OrderedDict()
+    for key in list(oldfields) + [k for k in newfields if k not in oldfields]:
+        oldval = oldfields.get(key)
+        newval = newfields.get(key)
+        if oldval != newval:
+            ret[key] = (_decode(key, oldval), _decode(key, newval))
+    return ret
+
+
+class ScratchDiff(object):
+    """
+    The result of diff(). Entries are paired up by record name and
+    track path, and duplicates of a path by their order.
+
+    'added' and 'removed' are lists of (path, entry). 'changed' is a
+    list of (path, old entry, new entry, {key: (old value, new value)})
+    with only the fields that differ. Paths are normalized, and None
+    for crate column records.
+    """
+    def __init__(self):
+        self.added = []
+        self.removed = []
+        self.changed = []
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def format(self):
+        """
+        Return the differences as text, one line per entry prefixed
+        with '+', '-' or '~', and changed fields indented below
+        """
+        lines = ["+ %s" % path for path, _ in self.added]
+        lines += ["- %s" % path for path, _ in self.removed]
+        for path, _, _, fields in self.changed:
+            lines.append("~ %s" % path)
+            for key, (oldval, newval) in fields.items():
+                lines.append("    %s: %r -> %r" % (key, oldval, newval))
+        return "".join(line + "\n" for line in lines)
+
+
+def diff(old, new):
+    """
+    Compare two snapshots of a database or crate, ScratchDatabase or
+    ScratchCrate objects, and return a ScratchDiff of what changed
+    from 'old' to 'new'.
+
+    Unmodified entries are compared as raw bytes, and for entries that
+    differ only the differing fields are decoded. Entries that only
+    differ in the order of their fields are considered the same.
+    """
+    ret = ScratchDiff()
+    oldentries = _keyed_entries(old)
+    for key, newentry in _keyed_entries(new).items():
+        oldentry = oldentries.pop(key, None)
+        if oldentry is None:
+            ret.added.append((key[1], newentry))
+        elif _entry_bytes(oldentry) != _entry_bytes(newentry):
+            fields = _changed_fields(oldentry, newentry)
+            if fields:
+                ret.changed.append((key[1], oldentry, newentry, fields))
+    ret.removed = [(key[1], entry) for key, entry in oldentries.items()]
+    return ret
+
+
+class ScratchMerge(object):
+    """
+    The result of merge(). 'entries' is the merged list of entries,
+    ready to assign to a ScratchDatabase or ScratchCrate 'entries'.
+
+    'conflicts' is a list of (path, key, base value, our value, their
+    value) for every field both sides changed differently, which were
+    resolved by taking our value. An entry one side deleted and the
+    other modified is kept, and reported with a key of None and values
+    of 'present', 'modified' or 'deleted'.
+
+    Merged entries can be shared with the input files, so keep those
+    open until the result is saved if they were loaded with mmap=True.
+    """
+    def __init__(self):
+        self.entries = []
+        self.conflicts = []
+
+
+def _merge_entry(ret, path, base, ours, theirs):
+    """
+    Merge the fields of one entry that exists on both sides. 'base' can
+    be None if both sides added it. Returns the merged entry.
+    """
+    basefields = dict(base._iter_raw_fields()) if base else {}
+    ourfields = dict(ours._iter_raw_fields())
+    theirfields = dict(theirs._iter_raw_fields())
+
+    merged = collections.OrderedDict()
+    keys = list(ourfields) + [k for k in theirfields if k not in ourfields]
+    for key in keys:
+        baseval = basefields.get(key)
+        ourval = ourfields.get(key)
+        theirval = theirfields.get(key)
+        if ourval == theirval or theirval == baseval:
+            val = ourval
+        elif ourval == baseval:
+            val = theirval
+        else:
+            ret.conflicts.append((path, key, _decode(key, baseval),
+                                  _decode(key, ourval),
+                                  _decode(key, theirval)))
+            val = ourval
+        if val is not None:
+            merged[key] = val
+
+    if list(merged.items()) == list(ourfields.items()):
+        return ours
+    if list(merged.items()) == list(theirfields.items()):
+        return theirs
+
+    entry = scratchdb._record_classes[ours._name]()
+    for key, val in merged.items():
+        entry._set_raw(key, val)
+    return entry
+
+
+def _unchanged(base, entry):
+    return _entry_bytes(base) == _entry_bytes(entry)
+
+
+def merge(base, ours, theirs):
+    """
+    Three-way merge of two snapshots 'ours' and 'theirs' of a database
+    or crate, that both started out as 'base'. Returns a ScratchMerge.
+
+    Entries are paired up like diff() does. Field changes made on only
+    one side are applied, entries added on either side are kept, and
+    entries deleted on one side and unchanged on the other are dropped.
+    Entries keep our order, with entries only they added at the end.
+    """
+    ret = ScratchMerge()
+    baseentries = _keyed_entries(base)
+    theirentries = _keyed_entries(theirs)
+
+    for key, ourentry in _keyed_entries(ours).items():
+        path = key[1]
+        baseentry = baseentries.pop(key, None)
+        theirentry = theirentries.pop(key, None)
+
+        if theirentry is None and baseentry is not None:
+            # Deleted by them
+            if _unchanged(baseentry, ourentry):
+                continue
+            ret.conflicts.append((path, None, "present", "modified",
+                                  "deleted"))
+            ret.entries.append(ourentry)
+        elif theirentry is None:
+            ret.entries.append(ourentry)
+        elif baseentry is not None and _unchanged(baseentry, theirentry):
+            ret.entries.append(ourentry)
+        elif baseentry is not None and _unchanged(baseentry, ourentry):
+            ret.entries.append(theirentry)
+        else:
+            ret.entries.append(_merge_entry(ret, path, baseentry,
+                                            ourentry, theirentry))
+
+    for key, theirentry in theirentries.items():
+        baseentry = baseentries.pop(key, None)
+        if baseentry is None:
+            ret.entries.append(theirentry)
+        elif not _unchanged(baseentry, theirentry):
+            # Deleted by us, modified by them
+            ret.conflicts.append((key[1], None, "present", "deleted",
+                                  "modified"))
+            ret.entries.append(theirentry)
+
+    return ret
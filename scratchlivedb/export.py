@@ -0,0 +1,151 @@
+import collections
+import csv
+import json
+import operator
+import re
+
+from scratchlivedb import scratchdb
+
+# pylint: disable=protected-access
+# Ignore 'Access to protected member'
+
+# Fields that aren't entry keys: the file the entry is from, and the
+# track path, pfil for databases and ptrk for crates
+PSEUDO_FIELDS = ["file", "path"]
+FORMATS = ["text", "csv", "tsv", "jsonl"]
+
+
+def _numeric(compare):
+    def _match(val, arg):
+        try:
+            return compare(float(val), float(arg))
+        except ValueError:
+            return False
+    return _match
+
+
+# Longer operators first, so '<=' isn't taken for '<'
+_OPERATORS = collections.OrderedDict([
+    ("!=", lambda val, arg: str(val) != arg),
+    ("<=", _numeric(operator.le)),
+    (">=", _numeric(operator.ge)),
+    ("=", lambda val, arg: str(val) == arg),
+    ("~", lambda val, arg: arg.lower() in str(val).lower()),
+    ("<", _numeric(operator.lt)),
+    (">", _numeric(operator.gt)),
+])
+_FILTER_RE = re.compile(r"^(\w+)(%s)(.*)$" %
+                        "|".join(re.escape(op) for op in _OPERATORS),
+                        re.DOTALL)
+
+
+def check_field(field):
+    """
+    Raise ValueError if 'field' isn't a pseudo field or a field key
+    whose type is known or can be guessed
+    """
+    if field in PSEUDO_FIELDS:
+        return
+    try:
+        if len(field) != 4:
+            raise RuntimeError()
+        scratchdb._key_to_type(field)
+    except RuntimeError:
+        raise ValueError("Unknown field '%s', expected a 4 letter field "
+                         "key like 'tart', or one of %s" %
+                         (field, ", ".join(PSEUDO_FIELDS)))
+
+
+def parse_filter(expr):
+    """
+    Parse a filter expression like 'tart=Daft Punk', 'tbpm>=120' or
+    'pfil~remix' into (field, operator, value).
+
+    '=' and '!=' compare the value as a string, '~' is a case insensitive
+    substring match, and '<', '<=', '>' and '>=' compare as numbers.
+    Entries missing the field only match '!='.
+    """
+    match = _FILTER_RE.match(expr)
+    if not match:
+        raise ValueError("Invalid filter '%s', expected FIELD OP VALUE "
+                         "with OP one of %s" % (expr, " ".join(_OPERATORS)))
+    field, op, value = match.groups()
+    check_field(field)
+    return field, op, value
+
+
+def _matches(values, filters):
+    for field, op, arg in filters:
+        val = values.get(field)
+        if val is None:
+            if op != "!=":
+                return False
+        elif not _OPERATORS[op](val, arg):
+            return False
+    return True
+
+
+def iter_rows(filenames, fields, filters=None, track_unknowns=False,
+              profile=None):
+    """
+    Yield a list of values of 'fields' for every track in 'filenames',
+    database or crate files, that matches all of 'filters', a list of
+    parse_filter() results. Missing values are None.
+
+    Files are streamed with iter_entries(), so memory use doesn't grow
+    with the file size, and only the fields asked for are decoded.
+    """
+    filters = filters or []
+    wanted = list(fields) + [field for field, _, _ in filters]
+    for filename in filenames:
+        cls = scratchdb._file_class(filename)
+        keys = dict((field, cls._pathkey if field == "path" else field)
+                    for field in wanted if field != "file")
+        rawkeys = sorted(set(keys.values()))
+        valtypes = dict((key, scratchdb._key_to_type(key))
+                        for key in rawkeys)
+
+        for entry in cls.iter_entries(filename, lazy=True,
+                                      decode_cache=False,
+                                      track_unknowns=track_unknowns,
+                                      profile=profile):
+            if entry._name != "otrk":
+                continue
+            raws = entry._get_raws(rawkeys)
+            decoded = dict((key, scratchdb._get_converter(
+                                key, rawval, valtypes[key]))
+                           for key, rawval in raws.items())
+            if profile:
+                for key in decoded:
+                    profile.count_decode(key)
+
+            values = dict((field, decoded.get(key))
+                          for field, key in keys.items())
+            values["file"] = filename
+            if _matches(values, filters):
+                yield [values[field] for field in fields]
+
+
+def write_rows(fileobj, rows, fields, fmt="text"):
+    """
+    Write every row from 'rows' to 'fileobj' as soon as it's produced.
+    'text' is tab separated values without a header, 'csv' and 'tsv' have
+    a header line of the field names, and 'jsonl' is a JSON object per line.
+    """
+    if fmt == "jsonl":
+        for row in rows:
+            fileobj.write(json.dumps(dict(zip(fields, row)),
+                                     ensure_ascii=False) + "\n")
+        return
+
+    if fmt == "text":
+        for row in rows:
+            fileobj.write("\t".join("" if val is None else str(val)
+                                    for val in row) + "\n")
+        return
+
+    dialect = "excel-tab" if fmt == "tsv" else "excel"
+    writer = csv.writer(fileobj, dialect=dialect, lineterminator="\n")
+    writer.writerow(fields)
+    for row in rows:
+        writer.writerow(["" if val is None else val for val in row])
@@ -0,0 +1,207 @@
+import logging
+import os
+import tempfile
+
+from scratchlivedb import scratchdb
+
+log = logging.getLogger("scratchlivedb")
+
+# pylint: disable=protected-access
+# Ignore 'Access to protected member'
+
+_UINT32 = scratchdb._UINT32
+_RECORD_NAMES = [name.encode("utf-8") for name in scratchdb._record_classes]
+
+
+class ValidationReport(object):
+    """
+    The result of validate(). 'errors' is a list of (offset, message)
+    for every problem found, in file order, and 'ok' is True if there
+    are none.
+
+    'filetype' is 'database' or 'crate', or None if the header wasn't
+    recognized. 'entries' is the number of entries that are valid, or
+    could be repaired, and 'salvaged' is how many were written to the
+    salvage file, if one was requested.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.filetype = None
+        self.entries = 0
+        self.salvaged = None
+        self.errors = []
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def _error(self, offset, msg, *args):
+        self.errors.append((offset, msg % args))
+
+
+def _field_name(content, offset):
+    """
+    Return the field or record name at 'offset' as a str, or None if
+    it isn't 4 ascii letters or digits
+    """
+    raw = content[offset:offset + 4]
+    if len(raw) != 4 or not raw.isalnum():
+        return None
+    return raw.decode("ascii")
+
+
+def _check_fields(report, content, start, end):
+    """
+    Walk the fields of the entry with data from 'start' to 'end'.
+    Returns (valid, repaired), where 'repaired' is the entry data with
+    duplicate fields dropped, or None if there were none.
+    """
+    offset = start
+    seen = set()
+    keep = []
+    dups = False
+    while offset < end:
+        if end - offset < 8:
+            report._error(offset, "truncated field header, %d bytes left "
+                          "in the entry", end - offset)
+            return False, None
+
+        name = _field_name(content, offset)
+        length = _UINT32.unpack_from(content, offset + 4)[0]
+        if name is None:
+            report._error(offset, "invalid field name %r",
+                          content[offset:offset + 4])
+            return False, None
+        if offset + 8 + length > end:
+            report._error(offset, "field '%s' length %d overruns its "
+                          "entry by %d bytes", name, length,
+                          offset + 8 + length - end)
+            return False, None
+
+        if name in seen:
+            report._error(offset, "duplicate field '%s'", name)
+            dups = True
+        else:
+            seen.add(name)
+            keep.append((offset, offset + 8 + length))
+        offset += 8 + length
+
+    if not dups:
+        return True, None
+    return True, b"".join(content[s:e] for s, e in keep)
+
+
+def _resync(content, offset):
+    """
+    Return the offset of the next thing that looks like a record
+    header after 'offset', or the end of the content
+    """
+    found = [content.find(name, offset + 1) for name in _RECORD_NAMES]
+    found = [idx for idx in found if idx >= 0]
+    return min(found) if found else len(content)
+
+
+def _walk_entries(report, content, offset, cls):
+    """
+    Walk every entry after the header, recording problems in 'report'.
+    Returns a list of (start, end, repaired data or None) for the
+    valid entries.
+    """
+    valid = []
+    while offset < len(content):
+        remaining = len(content) - offset
+        if remaining < 8:
+            report._error(offset, "truncated tail of %d bytes", remaining)
+            break
+
+        name = _field_name(content, offset)
+        length = _UINT32.unpack_from(content, offset + 4)[0]
+        end = offset + 8 + length
+        if name not in scratchdb._record_classes:
+            report._error(offset, "unknown entry name %r",
+                          content[offset:offset + 4])
+            offset = _resync(content, offset)
+            continue
+        if end > len(content):
+            report._error(offset, "truncated '%s' entry, length %d but "
+                          "only %d bytes left", name, length, remaining - 8)
+            offset = _resync(content, offset)
+            continue
+        misplaced = cls is scratchdb.ScratchDatabase and name != "otrk"
+        if misplaced:
+            report._error(offset, "unexpected '%s' entry in a database",
+                          name)
+
+        isvalid, repaired = _check_fields(report, content, offset + 8, end)
+        if isvalid and not misplaced:
+            if repaired is not None:
+                repaired = (name.encode("utf-8") +
+                            scratchdb._int2hexbin(len(repaired)) + repaired)
+            valid.append((offset, end, repaired))
+        offset = end
+    return valid
+
+
+def _write_salvage(content, header, valid, outfile):
+    """
+    Atomically write the header and valid entries to 'outfile'
+    """
+    dirname = os.path.dirname(os.path.abspath(outfile))
+    fd, tmpname = tempfile.mkstemp(suffix=".tmp", dir=dirname)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(header)
+            for start, end, repaired in valid:
+                f.write(content[start:end] if repaired is None else repaired)
+            f.flush()
+            os.fsync(f.fileno())
+        scratchdb._copy_file_mode(outfile, tmpname)
+        scratchdb._replace_file(tmpname, outfile, 0)
+    except BaseException:
+        if os.path.exists(tmpname):
+            os.unlink(tmpname)
+        raise
+
+
+def validate(filename, salvage=None):
+    """
+    Check the structure of the database or crate file 'filename' in a
+    single pass over the raw bytes, without building entry objects,
+    and return a ValidationReport listing every problem found.
+
+    The header is checked, and every entry and field length is walked.
+    Unknown entry names, lengths that overrun their entry or the file,
+    truncated tails and duplicate fields are all reported. After an
+    entry that can't be walked, checking picks up again at the next
+    thing that looks like an entry.
+
+    If 'salvage' is a file path, the valid entries are written to it
+    behind a correct header, with duplicate fields dropped, keeping
+    the first one.
+    """
+    report = ValidationReport(filename)
+    with open(filename, "rb") as f:
+        content = f.read()
+
+    cls = None
+    for trycls in [scratchdb.ScratchDatabase, scratchdb.ScratchCrate]:
+        if content.startswith(trycls._header_bytes()):
+            cls = trycls
+    if cls is None:
+        report._error(0, "not a Scratch Live database or crate header")
+        return report
+
+    report.filetype = "database"
+    if cls is scratchdb.ScratchCrate:
+        report.filetype = "crate"
+    header = cls._header_bytes()
+
+    valid = _walk_entries(report, content, len(header), cls)
+    report.entries = len(valid)
+    log.debug("Validated %s: %d valid entries, %d errors",
+              filename, report.entries, len(report.errors))
+
+    if salvage:
+        _write_salvage(content, header, valid, salvage)
+        report.salvaged = len(valid)
+    return report
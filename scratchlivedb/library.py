@@ -0,0 +1,174 @@
+import collections
+import concurrent.futures
+import glob
+import logging
+import os
+
+from scratchlivedb import scratchdb
+from scratchlivedb.scratchdb import ScratchCrate, ScratchDatabase
+
+log = logging.getLogger("scratchlivedb")
+
+
+def _crate_name(filename):
+    return os.path.splitext(os.path.basename(filename))[0]
+
+
+def _map(func, items, workers):
+    """
+    Return [func(item) for item in items], run by a thread pool of
+    'workers' threads, or serially if 'workers' is 1
+    """
+    if workers == 1:
+        return list(map(func, items))
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        return list(executor.map(func, items))
+
+
+class SeratoLibrary(object):
+    """
+    Represents a whole Serato library folder, usually called '_Serato_'.
+    That is the 'database V2' file, available as 'database', and every
+    crate file in the 'Subcrates' folder, available in the 'crates'
+    dict keyed by crate name, sorted by name.
+
+    The files are loaded in parallel by a thread pool with 'workers'
+    threads, which defaults to the concurrent.futures default. Results
+    don't depend on the number of workers, and workers=1 loads serially.
+    Any other keyword arguments, like lazy=True, are passed through to
+    the ScratchDatabase and ScratchCrate constructors.
+    """
+    def __init__(self, path, workers=None, **kwargs):
+        self.path = path
+        self.database = None
+        self.crates = {}
+
+        dbfile = os.path.join(path, "database V2")
+        cratefiles = sorted(glob.glob(
+                os.path.join(glob.escape(path), "Subcrates", "*.crate")))
+
+        jobs = [(ScratchCrate, filename) for filename in cratefiles]
+        if os.path.exists(dbfile):
+            jobs.insert(0, (ScratchDatabase, dbfile))
+
+        def _load(job):
+            cls, filename = job
+            log.debug("Loading %s", filename)
+            return cls(filename, **kwargs)
+
+        results = _map(_load, jobs, workers)
+
+        if os.path.exists(dbfile):
+            self.database = results.pop(0)
+        for filename, crate in zip(cratefiles, results):
+            self.crates[_crate_name(filename)] = crate
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        Release any file mappings, when loaded with mmap=True
+        """
+        for scratchfile in self.get_files():
+            scratchfile.close()
+
+    def get_files(self):
+        """
+        Return a list of the database, if there is one, and all crates
+        """
+        ret = [self.database] if self.database else []
+        return ret + list(self.crates.values())
+
+    def resolve(self, crate):
+        """
+        Return the database entries for each track of 'crate', which can
+        be a crate name or a ScratchCrate. Tracks that aren't in the
+        database are returned as None.
+        """
+        # pylint: disable=protected-access
+        # Ignore 'Access to protected member'
+        if not isinstance(crate, ScratchCrate):
+            crate = self.crates[crate]
+
+        ret = []
+        for entry in crate.entries:
+            path = crate._entry_path(entry)
+            if path is None:
+                continue
+            if self.database is None:
+                ret.append(None)
+            else:
+                ret.append(self.database.find_by_path(path))
+        return ret
+
+    def stats(self):
+        """
+        Return a dict of {filename: LibraryStats} for the database and
+        every crate, see ScratchDatabase.stats(). Crate tracks are counted
+        from their database entries, which are only decoded once.
+
+        This is a serial pass: the work is decoding fields in Python,
+        which a thread pool can't spread over cores.
+        """
+        ret = collections.OrderedDict()
+        for scratchfile in self.get_files():
+            if scratchfile is self.database:
+                ret[scratchfile.filename] = scratchfile.stats()
+            else:
+                ret[scratchfile.filename] = scratchfile.stats(self.database)
+        return ret
+
+    def relocate(self, old_prefix, new_prefix, backups=0):
+        """
+        Move every track path in the database and all crates from
+        'old_prefix' to 'new_prefix', see ScratchDatabase.relocate(),
+        and save every file that changed.
+
+        Saving is done in two steps: all changed files are first written
+        to temporary files, and only when that worked for every one of
+        them are they renamed over the originals. So a failure writing,
+        like a full disk, leaves every file on disk untouched. Each rename
+        is atomic but the set of them isn't: if one fails, the files
+        renamed before it stay relocated, and the temporary files of the
+        rest are removed.
+
+        Returns a dict of {filename: number of entries changed} for
+        every file in the library.
+        """
+        # pylint: disable=protected-access
+        # Ignore 'Access to protected member'
+        counts = collections.OrderedDict()
+        changed = []
+        for scratchfile in self.get_files():
+            count = scratchfile.relocate(old_prefix, new_prefix)
+            counts[scratchfile.filename] = count
+            if count:
+                changed.append(scratchfile)
+
+        written = []
+        try:
+            for scratchfile in changed:
+                log.debug("Writing relocated %s", scratchfile.filename)
+                written.append((scratchfile,) +
+                               scratchfile._write_temp(scratchfile.filename))
+        except BaseException:
+            for _, tmpname, _ in written:
+                os.unlink(tmpname)
+            raise
+
+        for idx, (scratchfile, tmpname, encoded) in enumerate(written):
+            try:
+                scratchdb._replace_file(tmpname, scratchfile.filename,
+                                        backups)
+            except BaseException:
+                for _, leftover, _ in written[idx:]:
+                    if os.path.exists(leftover):
+                        os.unlink(leftover)
+                raise
+            scratchfile._rebase_entries(encoded)
+            scratchfile._record_disk_state(scratchfile.filename)
+        return counts
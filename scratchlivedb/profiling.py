@@ -0,0 +1,83 @@
+import collections
+import time
+
+
+class Profile(object):
+    """
+    Opt-in timings and counters for loading and saving files. Pass
+    profile=True when loading a database or crate and it's available
+    as its 'profile' attribute, or pass a Profile to share one between
+    several files.
+
+    'phases' maps each phase name, like 'read', 'parse' or 'save', to
+    its number of calls, total seconds, and bytes and entries processed.
+    'decodes' counts field values decoded, by field key.
+
+    If 'callback' is set, it's called with (phase, seconds, nbytes,
+    nentries) at the end of every timed phase.
+    """
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.phases = collections.OrderedDict()
+        self.decodes = collections.Counter()
+
+    @staticmethod
+    def start():
+        """
+        Return the start time to pass to record()
+        """
+        return time.perf_counter()
+
+    def record(self, phase, start, nbytes=0, nentries=0):
+        """
+        Record a run of 'phase' that began at 'start'
+        """
+        seconds = time.perf_counter() - start
+        stats = self.phases.get(phase)
+        if stats is None:
+            stats = self.phases[phase] = {
+                "calls": 0, "seconds": 0.0, "bytes": 0, "entries": 0}
+        stats["calls"] += 1
+        stats["seconds"] += seconds
+        stats["bytes"] += nbytes
+        stats["entries"] += nentries
+
+        if self.callback:
+            self.callback(phase, seconds, nbytes, nentries)
+
+    def count_decode(self, key, count=1):
+        self.decodes[key] += count
+
+    def as_dict(self):
+        """
+        Return the collected numbers as a plain dict
+        """
+        return {"phases": dict((phase, dict(stats))
+                               for phase, stats in self.phases.items()),
+                "decodes": dict(self.decodes)}
+
+    def report(self):
+        """
+        Return the collected numbers formatted as a table
+        """
+        ret = "%-12s %6s %10s %12s %10s\n" % (
+                "phase", "calls", "seconds", "bytes", "entries")
+        for phase, stats in self.phases.items():
+            ret += "%-12s %6d %10.4f %12d %10d\n" % (
+                    phase, stats["calls"], stats["seconds"],
+                    stats["bytes"], stats["entries"])
+        if self.decodes:
+            ret += "decodes: %s\n" % ", ".join(
+                    "%s=%d" % item for item in sorted(self.decodes.items()))
+        return ret
+
+
+def make_profile(profile):
+    """
+    Return the Profile to use for a 'profile' option, or None
+    """
+    if not profile:
+        return None
+    if isinstance(profile, Profile):
+        return profile
+    return Profile()
@@ -1,12 +1,30 @@
 
+import bisect
+import collections
 import io
+import itertools
 import logging
+import mmap
 import os
+import posixpath
+import shutil
+import struct
+import sys
+import tempfile
 import time
+import unicodedata
 
+from scratchlivedb import sidecar
+from scratchlivedb.profiling import make_profile
+from scratchlivedb.stats import LibraryStats
 from scratchlivedb.unknownentry import UnknownEntryTracker
 
 _seen = []
+# Map of known field key to its value type
+_key_types = {}
+# Count of writes per field key to entries that are in an index, so
+# indexes can tell when they are stale
+_writes = collections.Counter()
 log = logging.getLogger("scratchlivedb")
 log.addHandler(logging.NullHandler())
 
@@ -16,95 +34,148 @@ log.addHandler(logging.NullHandler())
 #################
 
 # If we see a new file entry field in the serato database, this stuff helps
-# figure out what it's purpose is.
-_unknowns = UnknownEntryTracker()
+# figure out what it's purpose is. Pass track_unknowns=True when loading.
 
-
-def _make_unknown_str(entry):
+def _convert_unknown(key, val):
     """
-    Build a string listing some of the seen values which should
-    help determine what the key actually does
+    Format the value of an unknown key, guessing its type from the name
     """
-    maxprint = 20
-    dups = 20
-    keys = list(entry.values.keys())[:maxprint]
-
     try:
-        valtype = _unknown_key_to_type(entry.key)
+        valtype = _unknown_key_to_type(key)
     except Exception as e:
         log.debug(e)
-        valtype = None
-
-    ret = "Unknown type: %s\n" % entry.key
-    for val in keys:
-        files = sorted(entry.values[val])
-        msg = ""
-        idx = 0
-        for idx in range(min(len(files), dups)):
-            f = str(files[idx])
-            if msg:
-                msg += "\n"
-            msg += "  %-45s" % f[-min(len(f), 45):]
-
-        if valtype is not None:
-            converted_val = _get_converter(entry.key, val, valtype)
-        else:
-            converted_val = repr(val)
-
-        msg += " %-20s : %s" % ("(and %s others)" % (len(files) - idx - 1),
-                                converted_val)
-        ret += msg + "\n"
+        return repr(val)
+    return _get_converter(key, val, valtype)
 
-    return ret + "\n"
 
+def _make_tracker(track_unknowns):
+    if not track_unknowns:
+        return None
+    return UnknownEntryTracker(convert=_convert_unknown)
 
-def _log_unknowns():
-    keys = list(_unknowns.unknowns.keys())
-    keys.sort()
 
-    if keys:
-        log.warning("Unknown keys encountered: %s", keys)
-        log.warning("See debug output for details")
+def _log_unknowns(tracker):
+    try:
+        keys = tracker.keys()
+        if keys:
+            log.warning("Unknown keys encountered: %s", keys)
+            log.warning("See debug output for details")
 
-    for key in keys:
-        log.debug(_make_unknown_str(_unknowns.unknowns[key]))
+        if keys and log.isEnabledFor(logging.DEBUG):
+            log.debug(tracker.report())
+    except Exception as e:
+        log.debug("Error printing unknown values: %s", e)
 
 
 #####################
 # Utility functions #
 #####################
 
-def _parse_cstring(content):
-    """
-    From the passed string, find the nearest \0 byte and return everything
-    before it
-    """
-    ret = b""
-    while True:
-        char = content.read(1)
-        if char == b'\0':
-            break
-        ret += char
-
-    return ret
+# Big endian 32bit unsigned int, used for every length field in the format
+_UINT32 = struct.Struct(">I")
 
 
 def _int2hexbin(origint):
     """
     Convert the passed integer into a 4 byte binary hex string
     """
-    return origint.to_bytes(4, "big")
+    return _UINT32.pack(origint)
 
 
 def _hexbin2int(bytedata):
     """
     Convert the passed hex binary string into its interger value
     """
-    val = 0
+    return int.from_bytes(bytedata, "big")
 
-    for idx, byte in enumerate(bytedata):
-        val += byte * ((2 ** 8) ** ((len(bytedata) - 1) - idx))
-    return val
+
+def _map_file(filename):
+    """
+    Return a read only mmap of 'filename', or None if it can't be mapped
+    """
+    with open(filename, "rb") as f:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # pragma: no cover
+            # Empty files can't be mapped
+            return None
+
+
+def _fsync_dir(dirname):
+    """
+    fsync a directory, so a rename inside it is on disk
+    """
+    try:
+        fd = os.open(dirname, os.O_RDONLY)
+    except OSError:  # pragma: no cover
+        # Not supported on windows
+        return
+    try:
+        os.fsync(fd)
+    except OSError:  # pragma: no cover
+        pass
+    finally:
+        os.close(fd)
+
+
+def _backup_name(filename, idx):
+    if idx == 0:
+        return filename + ".bak"
+    return "%s.bak.%d" % (filename, idx)
+
+
+def _rotate_backups(filename, backups):
+    """
+    Shift existing backups of 'filename' along by one, dropping the
+    oldest, and keep the current 'filename' content as 'filename.bak'
+    """
+    for idx in reversed(range(backups - 1)):
+        src = _backup_name(filename, idx)
+        if os.path.exists(src):
+            os.replace(src, _backup_name(filename, idx + 1))
+
+    dst = _backup_name(filename, 0)
+    if os.path.exists(dst):
+        os.unlink(dst)
+    try:
+        # A hardlink leaves the original in place until it's replaced
+        os.link(filename, dst)
+    except OSError:  # pragma: no cover
+        shutil.copy2(filename, dst)
+
+
+def _copy_file_mode(filename, tmpname):
+    """
+    Give the temporary file 'tmpname' the mode of 'filename', or the
+    usual mode of a new file if there is none yet, since mkstemp
+    always creates files readable by their owner only
+    """
+    if os.path.exists(filename):
+        shutil.copymode(filename, tmpname)
+        return
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(tmpname, 0o666 & ~umask)
+
+
+def _replace_file(tmpname, filename, backups):
+    """
+    Atomically move the already synced 'tmpname' over 'filename',
+    after rotating 'backups' number of backup copies
+    """
+    if backups and os.path.exists(filename):
+        _rotate_backups(filename, backups)
+    os.replace(tmpname, filename)
+    _fsync_dir(os.path.dirname(os.path.abspath(filename)))
+
+
+def _normalize_path(path):
+    """
+    Normalize a track path for lookups. Serato stores paths relative to
+    the drive root, so any leading slash is dropped.
+    """
+    path = unicodedata.normalize("NFC", path.replace("\\", "/"))
+    return posixpath.normpath(path).lstrip("/") if path else path
 
 
 def _str_to_slstr(orig):
@@ -122,15 +193,39 @@ def _parse_slstr(bytedata):
     return bytedata.decode("utf-16-be")
 
 
-def _match_string(content, matchstr):
+def _match_string(content, offset, matchstr):
     """
-    Make sure the value starting 'content' is 'matchstr'
+    Make sure the value at 'offset' in buffer 'content' is 'matchstr'.
+    Returns the offset just past the matched string.
     """
-    readval = content.read(len(matchstr))
+    end = offset + len(matchstr)
+    readval = bytes(content[offset:end])
     if readval != matchstr:
         raise ScratchParseError(  # pragma: no cover
                 "Didn't find expected string "
                 "'%s', found '%s'" % (matchstr, readval))
+    return end
+
+
+def _unpack_field(content, offset):
+    """
+    Split out the field starting at 'offset' in buffer 'content'. A field
+    is a 4 character ascii name, a 4 byte length, and 'length' bytes
+    of data. Returns (name, datastart, dataend)
+    """
+    start = offset + 8
+    if start > len(content):
+        raise RuntimeError(  # pragma: no cover
+                "didn't read expected field header at offset %s" % offset)
+
+    # Keys repeat in every entry, interning them shares a single copy
+    name = sys.intern(str(content[offset:offset + 4], "utf-8"))
+    end = start + _UINT32.unpack_from(content, offset + 4)[0]
+    if end > len(content):
+        raise RuntimeError(  # pragma: no cover
+                "didn't read expected data length "
+                "(%s != %s)" % (len(content) - start, end - start))
+    return name, start, end
 
 
 ###########################
@@ -181,29 +276,43 @@ def _set_field_helper(self, key, valtype, rawval):
         raise RuntimeError(  # pragma: no cover
                 "Unknown property type %s" % valtype)
 
-    # pylint: disable=protected-access
-    # Ignore 'Access to protected member'
-    if key not in self._rawkeys:
-        self._rawkeys.append(key)
-    self._rawdict[key] = setval
-    # pylint: enable=protected-access
+    self._set_raw(key, setval)  # pylint: disable=protected-access
 
 
 def _get_field_helper(self, key, valtype):
     # pylint: disable=protected-access
     # Ignore 'Access to protected member'
+    decoded = self._decoded
+    if decoded and key in decoded:
+        return decoded[key]
+
+    self._check_fields()
     rawval = self._rawdict.get(key)
+    val = None
+    if rawval is not None:
+        val = _get_converter(key, rawval, valtype)
+        if self._profile is not None:
+            self._profile.count_decode(key)
+
+    if decoded is not False:
+        if decoded is None:
+            decoded = self._decoded = {}
+        decoded[key] = val
     # pylint: enable=protected-access
 
-    if rawval is None:
-        return None
+    return val
+
 
-    return _get_converter(key, rawval, valtype)
+def _key_to_type(key):
+    if key in _key_types:
+        return _key_types[key]
+    return _unknown_key_to_type(key)
 
 
 def _property_helper(key, valtype):
     if key not in _seen:
         _seen.append(key)
+    _key_types[key] = valtype
     getter = lambda self: _get_field_helper(self, key, valtype)
     setter = lambda self, val: _set_field_helper(self, key, valtype, val)
 
@@ -219,22 +328,24 @@ class _ScratchFileHeader(object):
     Parse file header format. Basically is
 
     vrsn\0\0%(version)s\0%(type)s\0
+
+    'size' is the byte length of the header, which is where the
+    first entry starts.
     """
     def __init__(self, content, version, ftype):
         self.version = version
         self.type = ftype
+        self.size = 0
 
         self._parse(content)
 
     def _parse(self, content):
-        if _parse_cstring(content) != b"vrsn":
+        if bytes(content[0:6]) != b"vrsn\0\0":
             raise ScratchParseError(  # pragma: no cover
                     "Header did not have expected prefix")
-        # Strip out next \0
-        _parse_cstring(content)
 
-        _match_string(content, _str_to_slstr(self.version))
-        _match_string(content, _str_to_slstr(self.type))
+        offset = _match_string(content, 6, _str_to_slstr(self.version))
+        self.size = _match_string(content, offset, _str_to_slstr(self.type))
 
     def get_final_content(self):
         ret = b"vrsn\0\0%s%s" % (_str_to_slstr(self.version),
@@ -242,18 +353,329 @@ class _ScratchFileHeader(object):
         return ret
 
 
-class _ScratchFileEntry(object):
+class _ScratchRecord(object):
     """
-    Parse a track entry from a crate/database file
+    Base class for the records of a crate/database file
 
-    First 4 characters are an ascii string describing the entry.
-        only handled value is 'otrk' for a playlist track entry
+    First 4 characters are an ascii string naming the record type, which
+    picks the subclass that handles it:
+        osrt :  crate sort column, _ScratchSortColumn
+        ovct :  crate visible column, _ScratchColumn
+        otrk :  playlist track entry, _ScratchFileEntry
 
     Next is 4 hex digits specifying the length of the following data
 
-    Finally is the data of the entry, which is 'length' bytes long
+    Finally is the data of the record, which is 'length' bytes long
 
     The data section is just a list of fields which have the above format.
+    Subclasses list their known fields in their doc string.
+
+    Libraries can have hundreds of thousands of records, so they use
+    __slots__, and the field table is a single dict of interned field
+    keys to raw bytes, in file order. Lazy records don't even have that
+    until it's needed, just their span in the shared file buffer.
+
+    Property values are cached in '_decoded' once decoded, and dropped
+    when the field is set. It's None until the first read, or False if
+    the cache is disabled with decode_cache=False. '_profile' is the
+    Profile that counts decodes, when the file is loaded with profiling.
+    """
+    __slots__ = ("_name", "_content", "_start", "_end",
+                 "_dirty", "_indexed", "_rawdict", "_decoded", "_profile")
+    _recordname = None
+
+    def __init__(self, content=None, offset=0, lazy=False,
+                 decode_cache=True):
+        self._name = self._recordname
+        self._content = None
+        self._start = offset
+        self._end = offset
+        self._dirty = False
+        self._indexed = False
+        self._rawdict = {}
+        self._decoded = None if decode_cache else False
+        self._profile = None
+
+        if content is not None:
+            self._parse(content, lazy)
+
+    def _parse(self, content, lazy):
+        self._name, _, self._end = _unpack_field(content, self._start)
+        if self._name != self._recordname:
+            raise ScratchParseError("Unknown entry header '%s'" % self._name)
+
+        self._content = content
+        if lazy:
+            self._rawdict = None
+        else:
+            self._load_fields()
+
+    @classmethod
+    def _from_span(cls, content, start, end, lazy, decode_cache):
+        """
+        Return a record for the span 'start' to 'end' of 'content', whose
+        header was already checked when the sidecar cache was written,
+        so it isn't parsed again. It's in the cached indexes, so it's
+        marked as indexed.
+        """
+        # Skip __init__, this runs for every entry of large files
+        entry = cls.__new__(cls)
+        entry._name = cls._recordname
+        entry._content = content
+        entry._start = start
+        entry._end = end
+        entry._dirty = False
+        entry._indexed = True
+        entry._rawdict = None
+        entry._decoded = None if decode_cache else False
+        entry._profile = None
+        if not lazy:
+            entry._load_fields()
+        return entry
+
+    def _load_fields(self):
+        """
+        Split the entry data into the field table. For lazy entries
+        this happens on first property access.
+        """
+        content = self._content
+        rawdict = {}
+        offset = self._start + 8
+        while offset < self._end:
+            name, start, offset = _unpack_field(content, offset)
+            if offset > self._end:
+                raise RuntimeError(  # pragma: no cover
+                        "field '%s' overruns its entry "
+                        "(%s > %s)" % (name, offset, self._end))
+
+            if name in rawdict:
+                raise RuntimeError(  # pragma: no cover
+                        "already found field for '%s'" % name)
+
+            rawdict[name] = bytes(content[start:offset])
+
+        self._rawdict = rawdict
+
+    def _check_fields(self):
+        """
+        Make sure the field table is built, for lazy entries
+        """
+        if self._rawdict is None:
+            self._load_fields()
+
+    def _get_raw(self, key):
+        """
+        Return the raw bytes of field 'key', or None. For lazy entries this
+        scans the entry data without building the field table.
+        """
+        if self._rawdict is not None:
+            return self._rawdict.get(key)
+
+        content = self._content
+        match = key.encode("utf-8")
+        offset = self._start + 8
+        while offset < self._end:
+            length = _UINT32.unpack_from(content, offset + 4)[0]
+            if content[offset:offset + 4] == match:
+                return bytes(content[offset + 8:offset + 8 + length])
+            offset += 8 + length
+        return None
+
+    def _iter_raw_fields(self):
+        """
+        Yield (key, raw bytes) for every field in the entry, without
+        building the field table for lazy entries
+        """
+        if self._rawdict is not None:
+            for item in self._rawdict.items():
+                yield item
+            return
+
+        content = self._content
+        offset = self._start + 8
+        while offset < self._end:
+            name, start, offset = _unpack_field(content, offset)
+            yield name, bytes(content[start:offset])
+
+    def _iter_unknown_fields(self):
+        """
+        Yield (key, raw bytes) for every field whose key isn't known.
+        For lazy entries only unknown field values are copied out.
+        """
+        if self._rawdict is not None:
+            for key, rawval in self._rawdict.items():
+                if key not in _key_types:
+                    yield key, rawval
+            return
+
+        content = self._content
+        offset = self._start + 8
+        while offset < self._end:
+            length = _UINT32.unpack_from(content, offset + 4)[0]
+            key = str(content[offset:offset + 4], "utf-8")
+            if key not in _key_types:
+                yield key, bytes(content[offset + 8:offset + 8 + length])
+            offset += 8 + length
+
+    def _get_raws(self, keys):
+        """
+        Return a dict of the raw bytes of every field in 'keys' that the
+        entry has, with a single scan for lazy entries
+        """
+        if self._rawdict is not None:
+            return dict((key, self._rawdict[key]) for key in keys
+                        if key in self._rawdict)
+
+        # Slicing bytes is a lot cheaper than slicing the memoryview of
+        # the file, so copy the entry out once
+        data = bytes(self._content[self._start:self._end])
+        matches = dict((key.encode("utf-8"), key) for key in keys)
+        ret = {}
+        offset = 8
+        while offset < len(data):
+            length = _UINT32.unpack_from(data, offset + 4)[0]
+            key = matches.get(data[offset:offset + 4])
+            if key is not None:
+                ret[key] = data[offset + 8:offset + 8 + length]
+                if len(ret) == len(matches):
+                    break
+            offset += 8 + length
+        return ret
+
+    def _populated_count(self):
+        """
+        Return the number of non-empty fields, only reading the field
+        lengths for lazy entries
+        """
+        if self._rawdict is not None:
+            return sum(1 for rawval in self._rawdict.values() if rawval)
+
+        content = self._content
+        count = 0
+        offset = self._start + 8
+        while offset < self._end:
+            length = _UINT32.unpack_from(content, offset + 4)[0]
+            if length:
+                count += 1
+            offset += 8 + length
+        return count
+
+    def _get_raw_fields(self):
+        """
+        Return the list of (key, raw bytes) for every field in the entry
+        """
+        self._check_fields()
+        return list(self._rawdict.items())
+
+    def _splice_raw(self, key, rawval):
+        """
+        Replace field 'key' of a lazy entry, or add it at the end, by
+        rebuilding the entry bytes around it. The field table isn't built.
+        """
+        content = self._content
+        match = key.encode("utf-8")
+        fieldstart = fieldend = self._end
+        offset = self._start + 8
+        while offset < self._end:
+            length = _UINT32.unpack_from(content, offset + 4)[0]
+            if content[offset:offset + 4] == match:
+                fieldstart, fieldend = offset, offset + 8 + length
+                break
+            offset += 8 + length
+
+        data = b"".join((content[self._start + 8:fieldstart],
+                         match, _int2hexbin(len(rawval)), rawval,
+                         content[fieldend:self._end]))
+        data = self._name.encode("utf-8") + _int2hexbin(len(data)) + data
+        self._content = data
+        self._start = 0
+        self._end = len(data)
+
+    def _set_raw(self, key, rawval):
+        """
+        Set field 'key' to the already encoded bytes 'rawval'. Lazy
+        entries stay lazy, their bytes are updated in place.
+        """
+        if self._rawdict is None:
+            self._splice_raw(key, rawval)
+        else:
+            self._rawdict[key] = rawval
+        if self._decoded:
+            self._decoded.pop(key, None)
+        self._dirty = True
+        if self._indexed:
+            _writes[key] += 1
+
+    ##############
+    # Public API #
+    ##############
+
+    def _span_is_current(self):
+        """
+        True if the entry's span of its buffer is its current content
+        """
+        return self._content is not None and (not self._dirty or
+                                              self._rawdict is None)
+
+    def get_final_content(self):
+        if self._span_is_current():
+            return bytes(self._content[self._start:self._end])
+
+        chunks = [self._name.encode("utf-8"), None]
+        length = 0
+        for key, data in self._rawdict.items():
+            chunks.extend((key.encode("utf-8"), _int2hexbin(len(data)), data))
+            length += 8 + len(data)
+        chunks[1] = _int2hexbin(length)
+
+        return b"".join(chunks)
+
+    def write_to(self, fileobj):
+        """
+        Write the entry content to the passed file object
+        """
+        if self._span_is_current():
+            fileobj.write(self._content[self._start:self._end])
+        else:
+            fileobj.write(self.get_final_content())
+
+
+
+class _ScratchSortColumn(_ScratchRecord):
+    """
+    The 'osrt' record at the start of a crate file, naming the column
+    the crate is sorted by. The known fields are:
+
+    tvcn :  column name, like 'song'
+    brev :  sort is reversed
+    """
+    __slots__ = ()
+    _recordname = "osrt"
+
+    columnname          = _property_helper("tvcn", TYPE_UTF16)
+    boolreverse         = _property_helper("brev", TYPE_INT1)
+
+
+class _ScratchColumn(_ScratchRecord):
+    """
+    The 'ovct' records after the sort column of a crate file, one for
+    each column visible in the crate view. The known fields are:
+
+    tvcn :  column name
+    tvcw :  column width, as a string
+    """
+    __slots__ = ()
+    _recordname = "ovct"
+
+    columnname          = _property_helper("tvcn", TYPE_UTF16)
+    columnwidth         = _property_helper("tvcw", TYPE_UTF16)
+
+
+class _ScratchFileEntry(_ScratchRecord):
+    """
+    Parse a track entry from a crate/database file. These are 'otrk'
+    records, see _ScratchRecord for the format.
+
     The known fields are:
 
     # boolean fields, contain either binary 0 or 1
@@ -317,20 +739,25 @@ class _ScratchFileEntry(object):
 
     """
 
-    def __init__(self, content=None, filename=None):
-        self._name = None
-        self._rawdata = None
-        self._rawkeys = []
-        self._rawdict = {}
+    __slots__ = ()
+    _recordname = "otrk"
 
-        if content is not None:
-            self._parse(content)
-        elif filename is not None:
+    def __init__(self, content=None, filename=None, offset=0, lazy=False,
+                 decode_cache=True):
+        _ScratchRecord.__init__(self, content, offset, lazy, decode_cache)
+        if content is None and filename is not None:
             self._set_stub_from_file(filename)
-        else:
-            raise RuntimeError(  # pragma: no cover
-                    "content or filename must be specified")
 
+    @classmethod
+    def _from_path(cls, key, path):
+        """
+        Return a new track whose only field is 'key' set to 'path', built
+        straight from the encoded bytes
+        """
+        rawpath = _str_to_slstr(path)
+        data = key.encode("utf-8") + _int2hexbin(len(rawpath)) + rawpath
+        return cls(content=b"otrk" + _int2hexbin(len(data)) + data,
+                   lazy=True)
 
     filedir             = _property_helper("pdir", TYPE_UTF16)
     filetrack           = _property_helper("ptrk", TYPE_UTF16)
@@ -379,46 +806,7 @@ class _ScratchFileEntry(object):
     bply                = _property_helper("bply", TYPE_INT1)
     sbav                = _property_helper("sbav", TYPE_CHAR)
 
-    def _parse(self, content):
-        def parse_field(c):
-            name = c.read(4)
-            rawlen = c.read(4)
-            length = _hexbin2int(rawlen)
-            data = c.read(length)
-            if len(data) != length:
-                raise RuntimeError(  # pragma: no cover
-                        "didn't read expected data length "
-                        "(%s != %s)" % (len(data), length))
-            return name.decode("utf-8"), data
-
-        self._name, self._rawdata = parse_field(content)
-        if self._name != "otrk":
-            ScratchParseError("Unknown entry header '%s'" % self._name)
-
-        datastream = io.BufferedReader(io.BytesIO(self._rawdata))
-        unknowns = []
-        while True:
-            if not datastream.peek(1):
-                break
-
-            name, data = parse_field(datastream)
-
-            if name in self._rawdict:
-                raise RuntimeError(  # pragma: no cover
-                        "already found field for '%s'" % name)
-
-            if name not in _seen:
-                unknowns.append((name, data))
-
-            self._rawkeys.append(name)
-            self._rawdict[name] = data
-
-        for name, data in unknowns:
-            _unknowns.track_unknown(self.filebase, name, data)
-
     def _set_stub_from_file(self, filename):
-        self._name = "otrk"
-
         # Scratch Live obviously supports other formats, but I haven't
         # tested any. Rather explicitly error than just wing it and have
         # things silently fail
@@ -440,23 +828,119 @@ class _ScratchFileEntry(object):
         self.filebase = filename
 
 
-    ##############
-    # Public API #
-    ##############
+# Fields that hold track paths
+_path_keys = ["pfil", "ptrk", "pdir"]
 
-    def get_final_content(self):
-        field_content = b""
-        for key in self._rawkeys:
-            data = self._rawdict[key]
-            field_content += key.encode("utf-8")
-            field_content += _int2hexbin(len(data))
-            field_content += data
-
-        ret = b""
-        ret += self._name.encode("utf-8")
-        ret += _int2hexbin(len(field_content))
-        ret += field_content
-        return ret
+
+# Record classes by record name
+# pylint: disable=protected-access
+_record_classes = dict((cls._recordname, cls) for cls in
+                       [_ScratchSortColumn, _ScratchColumn, _ScratchFileEntry])
+# pylint: enable=protected-access
+
+
+def _make_record(content, offset=0, lazy=False, decode_cache=True):
+    """
+    Parse the record starting at 'offset' in buffer 'content' with the
+    class for its record name
+    """
+    name = str(content[offset:offset + 4], "utf-8", "replace")
+    cls = _record_classes.get(name)
+    if cls is None:
+        raise ScratchParseError("Unknown entry header '%s'" % name)
+    return cls(content=content, offset=offset, lazy=lazy,
+               decode_cache=decode_cache)
+
+
+# numpy dtypes for bulk decoding fixed width fields in to_columns()
+_column_dtypes = {
+    TYPE_INT1: ("u1", 1, bool),
+    TYPE_CHAR: (">u2", 2, "int64"),
+    TYPE_INT4: (">u4", 4, "int64"),
+}
+
+
+# Field keys that stats() decodes
+_stat_keys = ["ttyp", "ufsb", "bmis", "bcrt", "tcor", "tbpm", "tkey", "uadd"]
+
+
+def _track_stats(entry, strings):
+    """
+    Decode just the stats fields of 'entry', in a single scan for lazy
+    entries, into a tuple of LibraryStats.add_track() arguments. Type
+    and key strings are shared through the 'strings' dict.
+    """
+    # pylint: disable=protected-access
+    # Ignore 'Access to protected member'
+    raws = entry._get_raws(_stat_keys)
+    bpm = None
+    if "tbpm" in raws:
+        try:
+            # Tracks that weren't analyzed have a BPM of 0
+            bpm = int(round(float(_parse_slstr(raws["tbpm"])))) or None
+        except (ValueError, OverflowError):
+            pass
+    ftype = raws.get("ttyp")
+    if ftype:
+        ftype = strings.get(ftype) or strings.setdefault(
+                ftype, _parse_slstr(ftype))
+    key = raws.get("tkey")
+    if key:
+        key = strings.get(key) or strings.setdefault(key, _parse_slstr(key))
+    size = raws.get("ufsb")
+    added = raws.get("uadd")
+    return (ftype,
+            size and _hexbin2int(size),
+            raws.get("bmis", b"\0") != b"\0",
+            raws.get("bcrt", b"\0") != b"\0" or bool(raws.get("tcor")),
+            bpm,
+            key,
+            added and _hexbin2int(added))
+
+
+def _make_column(numpy, key, rawvals):
+    """
+    Decode a list of raw field values (or None) into a numpy array
+    """
+    valtype = _key_to_type(key)
+    if valtype in _column_dtypes:
+        dtype, width, finaltype = _column_dtypes[valtype]
+        empty = b"\0" * width
+        if all(val is None or len(val) <= width for val in rawvals):
+            data = b"".join(empty if val is None else val.rjust(width, b"\0")
+                            for val in rawvals)
+            return numpy.frombuffer(data, dtype=dtype).astype(finaltype)
+
+        return numpy.array([0 if val is None else
+                            _get_converter(key, val, valtype)
+                            for val in rawvals]).astype(finaltype)
+
+    return numpy.array([None if val is None else
+                        _get_converter(key, val, valtype)
+                        for val in rawvals], dtype=object)
+
+
+class _EntryList(list):
+    """
+    The list of entries in a _ScratchFile. It counts every mutation
+    besides appending, so saving can tell whether the entries loaded
+    from disk are still in their original positions.
+    """
+    def __init__(self, *args):
+        list.__init__(self, *args)
+        self.mutations = 0
+
+
+def _count_mutation(func):
+    def _wrapper(self, *args, **kwargs):
+        self.mutations += 1
+        return func(self, *args, **kwargs)
+    return _wrapper
+
+
+for _funcname in ["__delitem__", "__imul__", "__setitem__", "clear",
+                  "insert", "pop", "remove", "reverse", "sort"]:
+    setattr(_EntryList, _funcname, _count_mutation(getattr(list, _funcname)))
 
 
 class _ScratchFile(object):
@@ -464,44 +948,1040 @@ class _ScratchFile(object):
     Base class for all serato files
     """
 
+    # Header values, set by subclasses
+    _version = None
+    _ftype = None
+    # Field holding the track path, set by subclasses
+    _pathkey = None
+
     @staticmethod
     def make_entry(filename):
         return _ScratchFileEntry(filename=filename)
 
-    def __init__(self, filename, version, ftype):
-        self.filename = filename
-        self._content = io.BufferedReader(
-                io.BytesIO(open(filename, "rb").read()))
+    @classmethod
+    def _header_bytes(cls):
+        return b"vrsn\0\0%s%s" % (_str_to_slstr(cls._version),
+                                  _str_to_slstr(cls._ftype))
 
-        self.header = _ScratchFileHeader(self._content, version, ftype)
-        self.entries = self._parse_entries()
+    @classmethod
+    def iter_entries(cls, filename, lazy=False, decode_cache=True,
+                     track_unknowns=False, profile=None):
+        """
+        Return a generator that reads and yields the entries of 'filename'
+        one at a time, without holding the whole file in memory.
+        The file header is checked before this returns.
 
-        try:
-            _log_unknowns()
-        except Exception as e:
-            log.debug("Error printing unknown values: %s", e)
-
-    def _parse_entries(self):
-        entries = []
-        while True:
-            if not self._content.peek(1):
-                break
+        Entries that are only read once don't gain anything from caching
+        decoded values, so decode_cache=False saves some memory here.
+
+        With track_unknowns=True, unknown field keys are logged once the
+        generator is exhausted.
+
+        'profile' can be a Profile to record the time spent reading and
+        parsing, not counting the time the caller holds each entry.
+        """
+        headerlen = len(cls._header_bytes())
 
-            entry = _ScratchFileEntry(content=self._content)
+        fobj = open(filename, "rb")
+        try:
+            _ScratchFileHeader(fobj.read(headerlen), cls._version, cls._ftype)
+        except Exception:
+            fobj.close()
+            raise
+
+        tracker = _make_tracker(track_unknowns)
+        prof = make_profile(profile)
+
+        def _generator():
+            with fobj:
+                while True:
+                    start = prof and prof.start()
+                    head = fobj.read(8)
+                    if not head:
+                        break
+                    if len(head) != 8:
+                        raise RuntimeError(  # pragma: no cover
+                                "didn't read expected entry header")
+
+                    data = fobj.read(_UINT32.unpack_from(head, 4)[0])
+                    entry = _make_record(head + data, lazy=lazy,
+                                         decode_cache=decode_cache)
+                    if tracker:
+                        cls._track_unknowns(tracker, entry)
+                    if prof:
+                        entry._profile = prof
+                        prof.record("parse", start, 8 + len(data), 1)
+                    yield entry
+
+            if tracker:
+                _log_unknowns(tracker)
+
+        return _generator()
+
+    # pylint: disable=redefined-outer-name
+    # Ignore 'Redefining name 'mmap' from outer scope'
+    def __init__(self, filename, lazy=False, mmap=False,
+                 cache=False, cache_dir=None, decode_cache=True,
+                 track_unknowns=False, profile=False):
+        self.filename = filename
+        self.profile = prof = make_profile(profile)
+        self._lazy = lazy
+        self._decode_cache = decode_cache
+        self._mapping = None
+
+        start = prof and prof.start()
+        stat = os.stat(filename)
+        if mmap:
+            self._mapping = _map_file(filename)
+
+        if self._mapping is not None:
+            self._content = memoryview(self._mapping)
+        else:
+            with open(filename, "rb") as f:
+                self._content = memoryview(f.read())
+        if prof:
+            prof.record("read", start, len(self._content))
+
+        start = prof and prof.start()
+        self.header = _ScratchFileHeader(self._content,
+                                         self._version, self._ftype)
+        if prof:
+            prof.record("header", start, self.header.size)
+        self._entries = None
+        self._pathindex = None
+        self._pathindex_state = None
+        self._cachedpaths = None
+        self._fieldindexes = {}
+        self._trackstats = None
+        self._trackstats_states = {}
+        self._disk_state = None
+        self._cachefile = None
+        if cache or cache_dir:
+            self._cachefile = sidecar.cache_filename(filename, cache_dir)
+
+        start = prof and prof.start()
+        cached = self._read_cache(stat)
+        if cached:
+            self.entries = self._entries_from_cache(cached)
+        else:
+            self.entries = self._parse_entries(self.header.size)
+        self._record_disk_state(filename)
+        if prof:
+            prof.record("cache load" if cached else "parse", start,
+                        len(self._content) - self.header.size,
+                        len(self._entries))
+
+        if cached:
+            self._seed_indexes(cached)
+        if self._cachefile and (not cached or
+                                cached["size"] != len(self._content)):
+            start = prof and prof.start()
+            self.write_cache()
+            if prof:
+                prof.record("cache write", start)
+
+        start = prof and prof.start()
+        self.unknowns = _make_tracker(track_unknowns)
+        if self.unknowns:
+            for entry in self._entries:
+                self._track_unknowns(self.unknowns, entry)
+            _log_unknowns(self.unknowns)
+            if prof:
+                prof.record("unknowns", start, nentries=len(self._entries))
+
+        if prof:
+            for entry in self._entries:
+                entry._profile = prof  # pylint: disable=protected-access
+
+    @classmethod
+    def _track_unknowns(cls, tracker, entry):
+        """
+        Pass any fields of 'entry' with unknown keys to 'tracker'
+        """
+        # pylint: disable=protected-access
+        # Ignore 'Access to protected member'
+        label = None
+        for key, rawval in entry._iter_unknown_fields():
+            if label is None:
+                rawpath = entry._get_raw(cls._pathkey)
+                label = rawpath and _parse_slstr(rawpath)
+            tracker.track_unknown(label, key, rawval)
+
+    def _get_entries(self):
+        return self._entries
+
+    def _set_entries(self, val):
+        if not isinstance(val, _EntryList):
+            val = _EntryList(val)
+        self._entries = val
+
+    entries = property(_get_entries, _set_entries)
+
+    def _parse_entries(self, offset, entries=None):
+        if entries is None:
+            entries = _EntryList()
+        while offset < len(self._content):
+            entry = _make_record(self._content, offset, self._lazy,
+                                 self._decode_cache)
             entries.append(entry)
+            offset = entry._end  # pylint: disable=protected-access
 
         return entries
 
-    def get_final_content(self):
-        entry_content = b""
-        for entry in self.entries:
-            entry_content += entry.get_final_content()
+    #################
+    # Sidecar cache #
+    #################
+
+    # pylint: disable=protected-access
+    # Ignore 'Access to protected member'
+
+    def _read_cache(self, stat):
+        """
+        Return the sidecar cache content if it's valid for the file we
+        loaded, either exactly or for a prefix that's since been
+        appended to. Otherwise return None.
+        """
+        if not self._cachefile:
+            return None
+        cached = sidecar.read_cache(self._cachefile, self._ftype)
+        if not cached:
+            return None
+
+        size = cached["size"]
+        if size == len(self._content):
+            valid = (cached["mtime_ns"] == stat.st_mtime_ns and
+                     cached["tailhash"] ==
+                     sidecar.tail_hash(self._content, size))
+        else:
+            valid = (size < len(self._content) and
+                     cached["fullhash"] ==
+                     sidecar.full_hash(self._content, size))
+
+        if not valid:
+            log.debug("Cache %s is stale", self._cachefile)
+            return None
+        return cached
+
+    def _entries_from_cache(self, cached):
+        """
+        Build the entries straight from the cached spans and record names,
+        without reading any entry headers, and parse any entries that were
+        appended since the cache was written
+        """
+        offsets = sidecar.unpack_offsets(cached["offsets"])
+        spans = zip(offsets, offsets[1:] + [cached["size"]])
+        entries = _EntryList()
+        for name, count in cached["names"]:
+            cls = _record_classes[name]
+            for start, end in itertools.islice(spans, count):
+                entries.append(cls._from_span(self._content, start, end,
+                                              self._lazy, self._decode_cache))
+        return self._parse_entries(cached["size"], entries)
+
+    def _seed_indexes(self, cached):
+        """
+        Fill in the path and field indexes from the cache
+        """
+        count = len(cached["paths"])
+        # The path index is built from the paths on first use
+        self._cachedpaths = cached["paths"]
+        self._pathindex_state = self._index_state(self._pathkey)[:3] + (
+                count,)
+
+        # Each field index only covers the entries it was built for,
+        # later ones are indexed on first use
+        for key, ranged, covered, index in cached["fieldindexes"]:
+            if ranged:
+                index = [tuple(item) for item in index]
+            else:
+                index = dict(index)
+            state = self._index_state(key)[:3] + (covered,)
+            self._fieldindexes[(key, ranged)] = (state, index)
+
+    def write_cache(self):
+        """
+        Write the sidecar cache for the file on disk, with the entry
+        spans and record names, the path of every entry, and any query
+        indexes that have been built. This is done automatically when
+        loading with a cache enabled, but calling it after query() or
+        save() means the next load gets the new indexes for free.
+
+        Nothing is written if there are unsaved changes besides
+        appended entries.
+        """
+        if not self._cachefile or not self._can_append(self.filename):
+            return
+
+        count = self._disk_state[3]
+        size = self._disk_state[4]
+        offsets = []
+        names = []
+        offset = self.header.size
+        for idx in range(count):
+            entry = self._entries[idx]
+            offsets.append(offset)
+            offset += entry._end - entry._start
+            # Records of a type come in runs, so store the names that way
+            if names and names[-1][0] == entry._name:
+                names[-1][1] += 1
+            else:
+                names.append([entry._name, 1])
+
+        paths = [self._entry_path(self._entries[idx]) for idx in range(count)]
+
+        fieldindexes = []
+        for (key, ranged), (state, index) in self._fieldindexes.items():
+            covered = min(self._index_count(state, key), count)
+            if not covered:
+                continue
+            if ranged:
+                index = [item for item in index if item[1] < covered]
+            else:
+                index = [(val, [idx for idx in idxs if idx < covered])
+                         for val, idxs in index.items()]
+            fieldindexes.append((key, ranged, covered, index))
+
+        mapping = _map_file(self.filename)
+        try:
+            content = memoryview(mapping)
+            cached = {
+                "ftype": self._ftype,
+                "size": size,
+                "mtime_ns": self._disk_state[5],
+                "tailhash": sidecar.tail_hash(content, size),
+                "fullhash": sidecar.full_hash(content, size),
+                "offsets": sidecar.pack_offsets(offsets),
+                "names": names,
+                "paths": paths,
+                "fieldindexes": fieldindexes,
+            }
+            content.release()
+        finally:
+            mapping.close()
+
+        sidecar.write_cache(self._cachefile, cached)
+
+    # pylint: enable=protected-access
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        Release the file mapping when opened with mmap=True. Entries
+        that still point into the mapping can't be used after this.
+        """
+        if self._mapping is None:
+            return
+        self._content.release()
+        self._mapping.close()
+        self._mapping = None
+
+    #############################
+    # Saving and dirty tracking #
+    #############################
 
-        ret = b""
-        ret += self.header.get_final_content()
-        ret += entry_content
+    # pylint: disable=protected-access
+    # Ignore 'Access to protected member'
+
+    def _record_disk_state(self, filename):
+        """
+        Remember what is on disk at 'filename' after loading or saving,
+        so a later save can tell if it only needs to append entries
+        """
+        stat = os.stat(filename)
+        self._disk_state = (os.path.abspath(filename), self._entries,
+                            self._entries.mutations, len(self._entries),
+                            stat.st_size, stat.st_mtime_ns)
+
+    def _can_append(self, filename):
+        """
+        Return True if the file at 'filename' holds exactly our current
+        entries, minus some that were appended since
+        """
+        if self._disk_state is None:
+            return False
+
+        (diskname, entries, mutations, count,
+         size, mtime) = self._disk_state
+        if (diskname != os.path.abspath(filename) or
+            entries is not self._entries or
+            mutations != entries.mutations or
+            count > len(entries)):
+            return False
+
+        try:
+            stat = os.stat(filename)
+        except OSError:  # pragma: no cover
+            return False
+        if (stat.st_size, stat.st_mtime_ns) != (size, mtime):
+            return False
+
+        for idx in range(count):
+            if entries[idx]._dirty or entries[idx]._content is None:
+                return False
+        return True
+
+    @staticmethod
+    def _write_entries(fileobj, entries):
+        """
+        Write out the passed entries. Runs of unmodified entries that
+        are contiguous in the same source buffer are copied with a single
+        write, only new and modified entries are encoded.
+
+        Returns a list of (entry, encoded bytes) for the encoded entries
+        """
+        encoded = []
+        content = None
+        start = end = 0
+        for entry in entries:
+            if entry._dirty or entry._content is None:
+                data = entry.get_final_content()
+                encoded.append((entry, data))
+            elif entry._content is content and entry._start == end:
+                end = entry._end
+                continue
+            else:
+                data = None
+
+            if content is not None:
+                fileobj.write(content[start:end])
+                content = None
+
+            if data is None:
+                content = entry._content
+                start, end = entry._start, entry._end
+            else:
+                fileobj.write(data)
+
+        if content is not None:
+            fileobj.write(content[start:end])
+        return encoded
+
+    @staticmethod
+    def _rebase_entries(encoded):
+        """
+        After a successful save, point encoded entries at their new
+        bytes so they count as unmodified
+        """
+        for entry, data in encoded:
+            entry._content = data
+            entry._start = 0
+            entry._end = len(data)
+            entry._dirty = False
+
+    def _append_to(self, filename):
+        """
+        Append the entries that are new since the last load or save to
+        the end of 'filename'
+        """
+        count, size = self._disk_state[3], self._disk_state[4]
+        with open(filename, "r+b") as f:
+            f.seek(size)
+            try:
+                encoded = self._write_entries(f,
+                        itertools.islice(self._entries, count, None))
+                f.flush()
+                os.fsync(f.fileno())
+            except BaseException:
+                f.truncate(size)
+                raise
+        return encoded
+
+    # pylint: enable=protected-access
+
+    ###############
+    # Path lookup #
+    ###############
+
+    # pylint: disable=protected-access
+    # Ignore 'Access to protected member'
+
+    def _index_state(self, key):
+        """
+        Snapshot of everything that can invalidate an index of 'key'
+        """
+        return (self._entries, self._entries.mutations,
+                _writes[key], len(self._entries))
+
+    def _index_count(self, state, key):
+        """
+        Return how many entries an index with snapshot 'state' is still
+        good for. Appending entries keeps an index valid, other list
+        changes or writes to 'key' on indexed entries mean a rebuild.
+        """
+        entries = self._entries
+        if (state is None or state[0] is not entries or
+            state[1] != entries.mutations or state[2] != _writes[key]):
+            return 0
+        return state[3]
+
+    def _iter_new_entries(self, count):
+        """
+        Yield (position, entry) for entries from 'count' on, marking them
+        as indexed
+        """
+        for idx in range(count, len(self._entries)):
+            entry = self._entries[idx]
+            entry._indexed = True
+            yield idx, entry
+
+    def _entry_path(self, entry):
+        path = entry._get_raw(self._pathkey)
+        if path is None:
+            return None
+        return _normalize_path(_parse_slstr(path))
+
+    def _get_path_index(self):
+        """
+        Return the {normalized path: [entries]} index, building or
+        refreshing it if needed
+        """
+        count = self._index_count(self._pathindex_state, self._pathkey)
+        if not count:
+            self._pathindex = {}
+        elif self._cachedpaths is not None:
+            self._pathindex = self._index_from_paths(self._cachedpaths)
+        self._cachedpaths = None
+
+        prof = self.profile
+        start = prof and prof.start()
+        index = self._pathindex
+        for _, entry in self._iter_new_entries(count):
+            index.setdefault(self._entry_path(entry), []).append(entry)
+
+        self._save_path_index_state()
+        if prof and count < len(self._entries):
+            prof.record("path index", start,
+                        nentries=len(self._entries) - count)
+        return index
+
+    def _index_from_paths(self, paths):
+        """
+        Build the path index from the list of cached entry paths
+        """
+        index = {}
+        for entry, path in zip(self._entries, paths):
+            if path in index:
+                index[path].append(entry)
+            else:
+                index[path] = [entry]
+        return index
+
+    def _save_path_index_state(self):
+        self._pathindex_state = self._index_state(self._pathkey)
+
+    def find_by_path(self, path):
+        """
+        Return the entry whose track path matches 'path', or None.
+        If there are duplicates, the first one is returned.
+        """
+        matches = self._get_path_index().get(_normalize_path(path))
+        return matches[0] if matches else None
+
+    def __contains__(self, path):
+        return _normalize_path(path) in self._get_path_index()
+
+    def _positions_of(self, entries):
+        """
+        Return the set of positions holding any of 'entries'
+        """
+        ids = set(id(entry) for entry in entries)
+        return set(pos for pos, entry in enumerate(self._entries)
+                   if id(entry) in ids)
+
+    def _remove_entries(self, positions):
+        """
+        Remove the entries at the list positions in 'positions' in a
+        single pass. Positions rather than entries are passed, so that
+        one entry object in the list twice loses only the copy asked for.
+        The caller has already dropped them from the path index.
+        """
+        if positions:
+            self._entries[:] = [entry for pos, entry
+                                in enumerate(self._entries)
+                                if pos not in positions]
+            self._save_path_index_state()
+
+    def remove_path(self, path):
+        """
+        Remove every entry whose track path matches 'path'. Returns the
+        number of entries removed.
+        """
+        index = self._get_path_index()
+        matches = index.pop(_normalize_path(path), [])
+        self._remove_entries(self._positions_of(matches))
+        return len(matches)
+
+    def replace_path(self, path, newentry):
+        """
+        Replace the first entry whose track path matches 'path' with
+        'newentry', keeping its position. Raises KeyError if there
+        is no matching entry.
+        """
+        index = self._get_path_index()
+        key = _normalize_path(path)
+        if key not in index:
+            raise KeyError(path)
+
+        oldentry = index[key].pop(0)
+        if not index[key]:
+            del index[key]
+        pos = self._entries.index(oldentry)
+        self._entries[pos] = newentry
+
+        # Keep the bucket in list order, so with duplicates find_by_path()
+        # still returns the first one
+        newentry._indexed = True
+        bucket = index.setdefault(self._entry_path(newentry), [])
+        slot = 0
+        while (slot < len(bucket) and
+               self._entries.index(bucket[slot]) < pos):
+            slot += 1
+        bucket.insert(slot, newentry)
+        self._save_path_index_state()
+
+    #################
+    # Field queries #
+    #################
+
+    def _get_field_index(self, key, ranged):
+        """
+        Return the index for field 'key', building or refreshing it if
+        needed. For exact matches this is a {value: [positions]} dict,
+        for 'ranged' numeric matches a sorted list of (value, position).
+        Values that can't be converted to a number aren't range indexed.
+        """
+        state, index = self._fieldindexes.get((key, ranged), (None, None))
+        count = self._index_count(state, key)
+        if not count:
+            index = [] if ranged else {}
+
+        prof = self.profile
+        start = prof and prof.start()
+        valtype = _key_to_type(key)
+        newitems = []
+        decodes = 0
+        for idx, entry in self._iter_new_entries(count):
+            rawval = entry._get_raw(key)
+            if rawval is None:
+                continue
+            val = _get_converter(key, rawval, valtype)
+            decodes += 1
+
+            if not ranged:
+                index.setdefault(val, []).append(idx)
+                continue
+            try:
+                newitems.append((float(val), idx))
+            except ValueError:
+                continue
+
+        if ranged and not count:
+            index.extend(newitems)
+            index.sort()
+        elif ranged:
+            for item in newitems:
+                bisect.insort(index, item)
+
+        self._fieldindexes[(key, ranged)] = (self._index_state(key), index)
+        if prof and count < len(self._entries):
+            prof.record("field index", start,
+                        nentries=len(self._entries) - count)
+            prof.count_decode(key, decodes)
+        return index
+
+    def _query_positions(self, key, match):
+        if not isinstance(match, tuple):
+            return self._get_field_index(key, False).get(match, [])
+
+        low, high = match
+        index = self._get_field_index(key, True)
+        start = 0
+        end = len(index)
+        if low is not None:
+            start = bisect.bisect_left(index, (float(low), -1))
+        if high is not None:
+            end = bisect.bisect_right(index, (float(high), len(self._entries)))
+        return [idx for _, idx in index[start:end]]
+
+    def query(self, select=None, **criteria):
+        """
+        Return the entries that match all of 'criteria', in file order.
+
+        Criteria are field keys like 'tart' or 'tbpm'. A plain value
+        matches exactly, through a hash index of the field. A (low, high)
+        tuple matches the inclusive numeric range, through a sorted index,
+        with None leaving that end open. Indexes are built on first use
+        and only decode the field they are for.
+
+            db.query(tkey="8A", tbpm=(120, 128), uadd=(timestamp, None))
+
+        If 'select' is a field key, return that field's value for each
+        match instead of the entries.
+        """
+        positions = None
+        for key, match in criteria.items():
+            found = self._query_positions(key, match)
+            if positions is None:
+                positions = set(found)
+            else:
+                positions.intersection_update(found)
+
+        if positions is None:
+            matches = list(self._entries)
+        else:
+            matches = [self._entries[idx] for idx in sorted(positions)]
+
+        if select is None:
+            return matches
+        valtype = _key_to_type(select)
+        ret = []
+        for entry in matches:
+            rawval = entry._get_raw(select)
+            ret.append(rawval if rawval is None else
+                       _get_converter(select, rawval, valtype))
+        if self.profile:
+            self.profile.count_decode(select, len(ret) - ret.count(None))
+        return ret
+
+    ###################
+    # Columnar export #
+    ###################
+
+    def to_columns(self, fields):
+        """
+        Return a dict of {key: numpy masked array} for every field key in
+        'fields', with one entry per track and missing values masked.
+        The raw bytes are collected in a single pass over the entries.
+
+        Integer fields become integer arrays, boolean 'b' fields become
+        bool arrays, both decoded in bulk by numpy. String fields become
+        object arrays of str.
+
+        This requires numpy, which is an optional dependency.
+        """
+        # pylint: disable=import-outside-toplevel
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError("to_columns() requires numpy. Install it "
+                              "with 'pip install scratchlivedb[numpy]'")
+
+        prof = self.profile
+        start = prof and prof.start()
+        fields = list(fields)
+        rawcolumns = dict((key, []) for key in fields)
+        for entry in self._entries:
+            raws = entry._get_raws(fields)
+            for key in fields:
+                rawcolumns[key].append(raws.get(key))
+
+        ret = {}
+        for key in fields:
+            rawvals = rawcolumns.pop(key)
+            mask = numpy.array([val is None for val in rawvals], dtype=bool)
+            ret[key] = numpy.ma.MaskedArray(
+                    _make_column(numpy, key, rawvals), mask=mask)
+            if prof:
+                prof.count_decode(key, len(rawvals) - int(mask.sum()))
+        if prof:
+            prof.record("to_columns", start, nentries=len(self._entries))
+        return ret
+
+    ###################
+    # Path relocation #
+    ###################
+
+    def relocate(self, old_prefix, new_prefix):
+        """
+        Change the start of every track path, the pfil, ptrk and pdir
+        fields, from 'old_prefix' to 'new_prefix'. The prefix only matches
+        whole path components, so 'music' matches 'music/a.mp3' but not
+        'music2/a.mp3', and 'music/' is the same as 'music'. With an
+        empty 'new_prefix' the prefix is dropped along with its slash.
+
+        Both prefixes are normalized like path lookups do: a leading or
+        trailing slash is dropped, since paths are stored without one,
+        and 'old_prefix' matches paths stored in either NFC or NFD form,
+        like macOS writes them. A path mixing both forms isn't matched.
+
+        Matching and replacing is done on the encoded bytes, paths are
+        never decoded. Returns the number of entries changed.
+        """
+        old_prefix = _normalize_path(old_prefix)
+        new_prefix = _normalize_path(new_prefix)
+        if not old_prefix or old_prefix == ".":
+            raise ValueError("old_prefix can't be empty")
+        if new_prefix == ".":
+            new_prefix = ""
+
+        prof = self.profile
+        start = prof and prof.start()
+        oldraws = set(_str_to_slstr(unicodedata.normalize(form, old_prefix))
+                      for form in ["NFC", "NFD"])
+        newraw = _str_to_slstr(new_prefix)
+        slash = _str_to_slstr("/")
+
+        changed = 0
+        for entry in self._entries:
+            raws = entry._get_raws(_path_keys)
+            relocated = False
+            for key, rawval in raws.items():
+                for oldraw in oldraws:
+                    if rawval.startswith(oldraw):
+                        break
+                else:
+                    continue
+                rest = rawval[len(oldraw):]
+                if rest and not rest.startswith(slash):
+                    continue
+                if not newraw:
+                    rest = rest[len(slash):]
+                entry._set_raw(key, newraw + rest)
+                relocated = True
+            if relocated:
+                changed += 1
+
+        if prof:
+            prof.record("relocate", start, nentries=changed)
+        return changed
+
+    #######################
+    # Duplicate detection #
+    #######################
+
+    def find_duplicates(self, keys=None):
+        """
+        Return the groups of tracks that have the same value for every
+        field key in 'keys', by default just the track path. Use keys
+        like ('ufsb', 'tart', 'tsng') to find the same file under
+        different paths. Tracks missing any of the fields are skipped.
+
+        Tracks are hashed into buckets on the raw field bytes in a single
+        pass, nothing is decoded besides path fields, which are compared
+        normalized like find_by_path() does.
+
+        Each group is a list of entries, starting with the best populated
+        one, the one with the most non-empty fields, which dedupe() keeps.
+        The rest follow in file order. Groups are in the order of their
+        first entry.
+        """
+        return [[self._entries[pos] for pos in group]
+                for group in self._duplicate_positions(keys)]
+
+    def _duplicate_positions(self, keys):
+        """
+        find_duplicates(), returning groups of list positions
+        """
+        keys = tuple(keys or (self._pathkey,))
+        prof = self.profile
+        start = prof and prof.start()
+
+        buckets = {}
+        for pos, entry in enumerate(self._entries):
+            if entry._name != "otrk":
+                continue
+            raws = entry._get_raws(keys)
+            if len(raws) != len(keys):
+                continue
+            bucket = tuple(
+                _normalize_path(_parse_slstr(raws[key]))
+                if key in _path_keys else raws[key] for key in keys)
+            buckets.setdefault(bucket, []).append(pos)
+
+        groups = []
+        for group in buckets.values():
+            if len(group) < 2:
+                continue
+            counts = [self._entries[pos]._populated_count()
+                      for pos in group]
+            best = counts.index(max(counts))
+            groups.append([group[best]] + group[:best] + group[best + 1:])
+
+        if prof:
+            prof.record("duplicates", start, nentries=len(self._entries))
+        return groups
+
+    def dedupe(self, keys=None):
+        """
+        Collapse every group of duplicates find_duplicates() returns for
+        'keys' down to its best populated track, which keeps its position.
+        Returns the number of tracks removed.
+        """
+        groups = self._duplicate_positions(keys)
+        index = self._get_path_index()
+        positions = set()
+        for group in groups:
+            for pos in group[1:]:
+                positions.add(pos)
+                entry = self._entries[pos]
+                path = self._entry_path(entry)
+                index[path].remove(entry)
+                if not index[path]:
+                    del index[path]
+        self._remove_entries(positions)
+        return len(positions)
+
+    ##############
+    # Statistics #
+    ##############
+
+    def _get_track_stats(self):
+        """
+        Return the {id(entry): stats tuple} of every track, see
+        _track_stats(), computing it for new tracks only. Like the field
+        indexes, it stays valid when entries are appended, and other
+        list changes or writes to a stats field mean a rebuild.
+        """
+        states = self._trackstats_states
+        count = min(self._index_count(states.get(key), key)
+                    for key in _stat_keys)
+        if not count:
+            self._trackstats = {}
+
+        prof = self.profile
+        start = prof and prof.start()
+        trackstats = self._trackstats
+        strings = {}
+        for _, entry in self._iter_new_entries(count):
+            if entry._name == "otrk":
+                trackstats[id(entry)] = _track_stats(entry, strings)
+
+        self._trackstats_states = dict((key, self._index_state(key))
+                                       for key in _stat_keys)
+        if prof and count < len(self._entries):
+            prof.record("track stats", start,
+                        nentries=len(self._entries) - count)
+        return trackstats
+
+    def stats(self, database=None):
+        """
+        Return a LibraryStats of every track. The fields it reports are
+        decoded once per track, in a single scan of each lazy entry, and
+        kept, so later calls only decode tracks added since.
+
+        Crate tracks only have a path, so for a crate pass the
+        ScratchDatabase to count each track from its database entry,
+        found through the database path index. The database entries
+        are only decoded once however many crates are counted.
+        """
+        prof = self.profile
+        start = prof and prof.start()
+        ret = LibraryStats()
+        if database is None:
+            trackstats = self._get_track_stats()
+            ret.add_tracks(trackstats[id(entry)] for entry in self._entries
+                           if entry._name == "otrk")
+        else:
+            trackstats = database._get_track_stats()
+            dbindex = database._get_path_index()
+            others = collections.Counter(
+                    self._entry_path(entry) for entry in self._entries
+                    if entry._name != "otrk")
+            tracks = []
+            for path, matches in self._get_path_index().items():
+                count = len(matches) - others.get(path, 0)
+                dbentries = dbindex.get(path) if path is not None else None
+                if not dbentries:
+                    ret.tracks += count
+                    ret.unresolved += count
+                elif count == 1:
+                    tracks.append(trackstats[id(dbentries[0])])
+                else:
+                    tracks.extend([trackstats[id(dbentries[0])]] * count)
+            ret.add_tracks(tracks)
+
+        if prof:
+            prof.record("stats", start, nentries=ret.tracks)
         return ret
 
+    # pylint: enable=protected-access
+
+    def write_to(self, fileobj):
+        """
+        Stream the file content to the passed file object
+        """
+        fileobj.write(self.header.get_final_content())
+        self._write_entries(fileobj, self.entries)
+
+    def _write_temp(self, filename):
+        """
+        Stream the content to a new temporary file next to 'filename',
+        and fsync it. Returns the temporary file path and the list of
+        encoded entries.
+        """
+        dirname, basename = os.path.split(os.path.abspath(filename))
+        fd, tmpname = tempfile.mkstemp(prefix=".%s." % basename,
+                                       suffix=".tmp", dir=dirname)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(self.header.get_final_content())
+                encoded = self._write_entries(f, self.entries)
+                f.flush()
+                os.fsync(f.fileno())
+            _copy_file_mode(filename, tmpname)
+        except BaseException:
+            os.unlink(tmpname)
+            raise
+        return tmpname, encoded
+
+    def save(self, filename=None, backups=0, append=False):
+        """
+        Write the file content to 'filename', which defaults to the
+        file we were loaded from.
+
+        The content is streamed to a temporary file in the same directory,
+        fsync'd, and atomically renamed over 'filename', so a crash
+        never leaves a half written file behind. The original file is
+        untouched until the rename, so lazy and mmap entries can safely
+        read from it while saving.
+
+        Only entries that are new or were modified are encoded, everything
+        else is copied from the source buffer.
+
+        :param backups: If non zero, keep this many rotated copies of
+            the previous content, named 'filename.bak', 'filename.bak.1',
+            and so on, newest first.
+        :param append: If the only change since the last load or save of
+            'filename' is appended entries, and no backups are requested,
+            append the new entries to the existing file in place instead.
+            This is much faster for large files, but isn't crash safe: a
+            crash part way through can leave a truncated entry at the end
+            of the file, which then fails to load.
+        """
+        prof = self.profile
+        start = prof and prof.start()
+        filename = filename or self.filename
+        if append and not backups and self._can_append(filename):
+            encoded = self._append_to(filename)
+        else:
+            tmpname, encoded = self._write_temp(filename)
+            try:
+                _replace_file(tmpname, filename, backups)
+            except BaseException:
+                if os.path.exists(tmpname):
+                    os.unlink(tmpname)
+                raise
+
+        self._rebase_entries(encoded)
+        self._record_disk_state(filename)
+        if prof:
+            prof.record("save", start, self._disk_state[4], len(encoded))
+
+    def get_final_content(self):
+        prof = self.profile
+        start = prof and prof.start()
+        ret = io.BytesIO()
+        self.write_to(ret)
+        content = ret.getvalue()
+        if prof:
+            prof.record("serialize", start, len(content), len(self.entries))
+        return content
+
 
 ##############
 # Public API #
@@ -514,17 +1994,195 @@ class ScratchParseError(Exception):
 class ScratchCrate(_ScratchFile):
     """
     Represents a serato crate file
+
+    With lazy=True, entry fields aren't split out until a property is
+    first read or written, and unmodified entries are saved back from
+    their original bytes.
+
+    With mmap=True, the file is memory mapped rather than read into
+    memory, so the pages are shared with other processes. Combine it
+    with lazy=True so only the entries that are used get paged in.
+    Use close() or a 'with' block to release the mapping.
+
+    With cache=True, the entry spans and record names, and the path and
+    query indexes, are stored in a 'filename.slcache' sidecar file, or
+    in 'cache_dir' if that's passed. Reopening an unchanged file then
+    skips reading entry headers and building indexes, and a file that
+    was only appended to only has the new entries parsed. This pays off
+    the most with lazy=True.
+
+    Property values are cached per entry once decoded, so sorting or
+    grouping by a property doesn't decode the same bytes over and over.
+    Setting the property drops the cached value. Pass decode_cache=False
+    to turn this off when memory matters more.
+
+    With track_unknowns=True, fields with keys this module doesn't know
+    are collected in 'unknowns', an UnknownEntryTracker, and logged.
+    Otherwise 'unknowns' is None and no tracking is done.
+
+    With profile=True, time spent in each phase of loading, indexing and
+    saving, and the number of field values decoded, are collected in
+    'profile', a Profile. Pass a Profile instead to share one between
+    files, or to set a callback. Otherwise 'profile' is None.
+
+    find_by_path(), remove_path(), replace_path() and 'path in crate'
+    look up tracks by their path field through an index that's kept in
+    sync with changes to 'entries' and to entry paths.
+
+    stats() counts the tracks by type, key, BPM and month added, along
+    with their total size and how many are missing or corrupt. Pass it
+    the ScratchDatabase to count the fields of the crate tracks.
+
+    find_duplicates() groups tracks with the same path, or the same
+    values for any other set of fields, and dedupe() collapses each
+    group down to its best populated track.
+
+    'entries' holds every record of the crate in file order: the 'osrt'
+    sort column, the 'ovct' visible columns, then the 'otrk' tracks.
+    'sortcolumn', 'columns' and 'tracks' split them out by type, and
+    'trackpaths' is just the track paths. add_tracks(), remove_tracks()
+    and dedupe_tracks() work on many paths at once through the path
+    index, and never split out the fields of the tracks.
     """
-    def __init__(self, filename):
-        _ScratchFile.__init__(self, filename,
-                            "81.0", "/Serato ScratchLive Crate")
+    # pylint: disable=protected-access
+    # Ignore 'Access to protected member'
+
+    _version = "81.0"
+    _ftype = "/Serato ScratchLive Crate"
+    _pathkey = "ptrk"
+
+    @staticmethod
+    def make_entry(filename):
+        """
+        Return a new crate track for 'filename'. Crate tracks only
+        have a ptrk path, the rest of the info is in the database.
+        """
+        return _ScratchFileEntry._from_path("ptrk", filename)
+
+    def _get_records(self, name):
+        return [entry for entry in self._entries if entry._name == name]
+
+    @property
+    def sortcolumn(self):
+        """
+        The 'osrt' sort column record, or None
+        """
+        records = self._get_records("osrt")
+        return records[0] if records else None
+
+    @property
+    def columns(self):
+        """
+        List of the 'ovct' visible column records
+        """
+        return self._get_records("ovct")
+
+    @property
+    def tracks(self):
+        """
+        List of the 'otrk' track records
+        """
+        return self._get_records("otrk")
+
+    @property
+    def trackpaths(self):
+        """
+        List of the path of every track, decoded straight from the ptrk
+        field without splitting out the rest of the entry
+        """
+        ret = []
+        for entry in self._entries:
+            if entry._name != "otrk":
+                continue
+            rawpath = entry._get_raw("ptrk")
+            if rawpath is not None:
+                ret.append(_parse_slstr(rawpath))
+        return ret
+
+    def add_tracks(self, paths):
+        """
+        Append a track for every path in 'paths' that isn't in the crate
+        yet. The tracks are built straight from the encoded path.
+        Returns the number of tracks added.
+        """
+        index = self._get_path_index()
+        added = 0
+        for path in paths:
+            key = _normalize_path(path)
+            if key in index:
+                continue
+            entry = self.make_entry(path)
+            self._entries.append(entry)
+            entry._indexed = True
+            index[key] = [entry]
+            added += 1
+        self._save_path_index_state()
+        return added
+
+    def remove_tracks(self, paths):
+        """
+        Remove every track matching a path in 'paths', in a single pass
+        over the crate. Returns the number of tracks removed.
+        """
+        index = self._get_path_index()
+        removed = []
+        for path in paths:
+            removed.extend(index.pop(_normalize_path(path), []))
+        positions = self._positions_of(removed)
+        self._remove_entries(positions)
+        return len(positions)
+
+    def dedupe_tracks(self):
+        """
+        Remove every track whose path is already in the crate earlier
+        on, keeping the first. Returns the number of tracks removed.
+        """
+        index = self._get_path_index()
+        duppaths = {}
+        for path, matches in index.items():
+            if path is None or len(matches) < 2:
+                continue
+            duppaths.update((id(entry), path) for entry in matches)
+
+        seen = set()
+        positions = set()
+        for pos, entry in enumerate(self._entries):
+            path = duppaths.get(id(entry))
+            if path is None:
+                continue
+            if path in seen:
+                positions.add(pos)
+            else:
+                seen.add(path)
+                index[path] = [entry]
+        self._remove_entries(positions)
+        return len(positions)
 
 
 class ScratchDatabase(_ScratchFile):
     """
     Represents a "database V2" serato file, which contains the music
     library info
+
+    See ScratchCrate for the meaning of the load options
+    """
+    _version = "@2.0"
+    _ftype = "/Serato Scratch LIVE Database"
+    _pathkey = "pfil"
+
+
+def _file_class(filename):
     """
-    def __init__(self, filename):
-        _ScratchFile.__init__(self, filename,
-                            "@2.0", "/Serato Scratch LIVE Database")
+    Return ScratchDatabase or ScratchCrate depending on the header
+    of 'filename'
+    """
+    # pylint: disable=protected-access
+    # Ignore 'Access to protected member'
+    classes = [ScratchDatabase, ScratchCrate]
+    with open(filename, "rb") as f:
+        head = f.read(max(len(cls._header_bytes()) for cls in classes))
+    for cls in classes:
+        if head.startswith(cls._header_bytes()):
+            return cls
+    raise ScratchParseError("%s is not a Scratch Live database or "
+                            "crate file" % filename)
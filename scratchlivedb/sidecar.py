@@ -0,0 +1,104 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import struct
+import tempfile
+
+log = logging.getLogger("scratchlivedb")
+
+# Bump this if the cache content changes incompatibly
+CACHE_VERSION = 3
+# How much of the end of the cached file content is hashed to
+# validate the cache
+FINGERPRINT_SIZE = 64 * 1024
+
+
+def cache_filename(filename, cache_dir=None):
+    """
+    Return the cache file path for 'filename'. Without a 'cache_dir'
+    the cache is a sidecar file next to 'filename'
+    """
+    if cache_dir is None:
+        return filename + ".slcache"
+    digest = hashlib.sha1(
+            os.path.abspath(filename).encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, digest + ".slcache")
+
+
+def tail_hash(content, end):
+    """
+    Hash the last FINGERPRINT_SIZE bytes of 'content' up to 'end'. This
+    is a cheap check that the cached content wasn't rewritten.
+    """
+    start = max(0, end - FINGERPRINT_SIZE)
+    return hashlib.sha1(content[start:end]).hexdigest()
+
+
+def full_hash(content, end):
+    """
+    Hash all of 'content' up to 'end'. Content is only ever appended to
+    these files, so this is checked before reusing a cache for a file
+    that has grown.
+    """
+    return hashlib.sha1(content[:end]).hexdigest()
+
+
+def pack_offsets(offsets):
+    """
+    Encode a list of file offsets as a compact string, which is a lot
+    quicker to load than a JSON list of numbers
+    """
+    data = struct.pack(">%dI" % len(offsets), *offsets)
+    return base64.b64encode(data).decode("ascii")
+
+
+def unpack_offsets(text):
+    """
+    Decode the list of offsets from a pack_offsets() string
+    """
+    data = base64.b64decode(text)
+    return list(struct.unpack(">%dI" % (len(data) // 4), data))
+
+
+def read_cache(cachefile, ftype):
+    """
+    Return the cache dict stored in 'cachefile', or None if it doesn't
+    exist or isn't usable
+    """
+    try:
+        with open(cachefile, "r") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        log.debug("Not using cache %s: %s", cachefile, e)
+        return None
+
+    if (not isinstance(data, dict) or
+        data.get("version") != CACHE_VERSION or
+        data.get("ftype") != ftype):
+        log.debug("Not using cache %s: incompatible content", cachefile)
+        return None
+    return data
+
+
+def write_cache(cachefile, data):
+    """
+    Atomically write the cache dict 'data' to 'cachefile'. Failure
+    isn't fatal, it just means the next load is slow.
+    """
+    data = dict(data, version=CACHE_VERSION)
+    dirname = os.path.dirname(os.path.abspath(cachefile))
+    try:
+        fd, tmpname = tempfile.mkstemp(suffix=".tmp", dir=dirname)
+    except OSError as e:
+        log.debug("Error writing cache %s: %s", cachefile, e)
+        return
+
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmpname, cachefile)
+    except (OSError, TypeError, ValueError) as e:
+        log.debug("Error writing cache %s: %s", cachefile, e)
+        os.unlink(tmpname)
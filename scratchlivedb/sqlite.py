@@ -0,0 +1,241 @@
+import collections
+import hashlib
+import logging
+import os
+import sqlite3
+
+from scratchlivedb import scratchdb
+
+log = logging.getLogger("scratchlivedb")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    id INTEGER PRIMARY KEY,
+    filename TEXT UNIQUE NOT NULL,
+    kind TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    source_id INTEGER NOT NULL REFERENCES sources(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    path TEXT,
+    ordinal INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    UNIQUE (source_id, path, ordinal)
+);
+
+CREATE TABLE IF NOT EXISTS entry_fields (
+    entry_id INTEGER NOT NULL REFERENCES entries(id) ON DELETE CASCADE,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    PRIMARY KEY (entry_id, key)
+);
+
+CREATE INDEX IF NOT EXISTS entries_path ON entries (path);
+"""
+
+
+def _known_columns():
+    """
+    Return [(key, sql type)] for every known field key
+    """
+    # pylint: disable=protected-access
+    # Ignore 'Access to protected member'
+    ret = []
+    for key, valtype in sorted(scratchdb._key_types.items()):
+        if valtype == scratchdb.TYPE_UTF16:
+            ret.append((key, "TEXT"))
+        else:
+            ret.append((key, "INTEGER"))
+    return ret
+
+
+def _ensure_schema(conn, columns):
+    """
+    Create the tables, and add columns for any field keys that are
+    new since the file was created
+    """
+    conn.executescript(_SCHEMA)
+    have = set(row[1] for row in conn.execute("PRAGMA table_info(entries)"))
+    for key, sqltype in columns:
+        if key not in have:
+            conn.execute('ALTER TABLE entries ADD COLUMN "%s" %s' %
+                         (key, sqltype))
+
+
+def _split_fields(entry, columns):
+    """
+    Return a dict of decoded known field values, and a list of
+    (key, raw bytes) for the fields that have to be stored raw
+    """
+    # pylint: disable=protected-access
+    # Ignore 'Access to protected member'
+    values = {}
+    raws = []
+    for key, rawval in entry._iter_raw_fields():
+        if key not in columns:
+            raws.append((key, rawval))
+            continue
+        try:
+            values[key] = scratchdb._get_converter(
+                    key, rawval, scratchdb._key_types[key])
+        except (TypeError, ValueError):
+            # ord() of a 'b' field that isn't a single byte is a TypeError
+            raws.append((key, rawval))
+    return values, raws
+
+
+_ROW_NAMES = ["source_id", "name", "path", "ordinal", "position", "digest"]
+
+
+class _Syncer(object):
+    """
+    Sync the entries of one database or crate into the SQLite file.
+
+    Writes are queued and run with executemany() every 'batch_size'
+    entries. New rows get explicit ids so their fields can be queued
+    along with them, without waiting for each insert's lastrowid.
+    """
+    def __init__(self, conn, columns, batch_size, counts):
+        self.conn = conn
+        self.columns = columns
+        self._columnset = set(columns)
+        self.batch_size = batch_size
+        self.counts = counts
+        self._nextid = conn.execute(
+                "SELECT COALESCE(MAX(id), 0) + 1 FROM entries").fetchone()[0]
+
+        names = _ROW_NAMES + ['"%s"' % key for key in columns]
+        self._insert_sql = "INSERT INTO entries (id, %s) VALUES (%s)" % (
+                ", ".join(names), ", ".join("?" * (len(names) + 1)))
+        self._update_sql = "UPDATE entries SET %s WHERE id = ?" % (
+                ", ".join("%s = ?" % name for name in names))
+        self._reset()
+
+    def _reset(self):
+        self._inserts = []
+        self._updates = []
+        self._positions = []
+        self._fielddeletes = []
+        self._fields = []
+
+    def _flush(self):
+        """
+        Run all queued writes and commit
+        """
+        self.conn.executemany(self._insert_sql, self._inserts)
+        self.conn.executemany(self._update_sql, self._updates)
+        self.conn.executemany(
+                "UPDATE entries SET position = ? WHERE id = ?",
+                self._positions)
+        self.conn.executemany(
+                "DELETE FROM entry_fields WHERE entry_id = ?",
+                self._fielddeletes)
+        self.conn.executemany(
+                "INSERT INTO entry_fields (entry_id, key, value) "
+                "VALUES (?, ?, ?)", self._fields)
+        self.conn.commit()
+        self._reset()
+
+    def _write_entry(self, rowid, row, entry):
+        values, raws = _split_fields(entry, self._columnset)
+        params = row + [values.get(key) for key in self.columns]
+
+        if rowid is None:
+            rowid = self._nextid
+            self._nextid += 1
+            self._inserts.append([rowid] + params)
+        else:
+            self._updates.append(params + [rowid])
+            self._fielddeletes.append((rowid,))
+        self._fields.extend((rowid, key, rawval) for key, rawval in raws)
+
+        if len(self._inserts) + len(self._updates) >= self.batch_size:
+            self._flush()
+
+    def sync(self, scratchfile):
+        # pylint: disable=protected-access
+        # Ignore 'Access to protected member'
+        filename = os.path.abspath(scratchfile.filename)
+        kind = "crate"
+        if isinstance(scratchfile, scratchdb.ScratchDatabase):
+            kind = "database"
+
+        self.conn.execute(
+                "INSERT OR IGNORE INTO sources (filename, kind) VALUES (?, ?)",
+                (filename, kind))
+        source_id = self.conn.execute(
+                "SELECT id FROM sources WHERE filename = ?",
+                (filename,)).fetchone()[0]
+
+        existing = {}
+        for rowid, path, ordinal, digest, position in self.conn.execute(
+                "SELECT id, path, ordinal, digest, position FROM entries "
+                "WHERE source_id = ?", (source_id,)):
+            existing[(path, ordinal)] = (rowid, digest, position)
+
+        ordinals = collections.Counter()
+        for position, entry in enumerate(scratchfile.entries):
+            path = scratchfile._entry_path(entry)
+            ordinal = ordinals[path]
+            ordinals[path] += 1
+            digest = hashlib.sha1(entry.get_final_content()).hexdigest()
+
+            rowid, olddigest, oldposition = existing.pop(
+                    (path, ordinal), (None, None, None))
+            if olddigest == digest:
+                if oldposition != position:
+                    self._positions.append((position, rowid))
+                self.counts["unchanged"] += 1
+                continue
+
+            self.counts["inserted" if rowid is None else "updated"] += 1
+            row = [source_id, entry._name, path, ordinal, position, digest]
+            self._write_entry(rowid, row, entry)
+
+        removed = [(val[0],) for val in existing.values()]
+        self._fielddeletes.extend(removed)
+        self._flush()
+        self.conn.executemany("DELETE FROM entries WHERE id = ?", removed)
+        self.counts["deleted"] += len(removed)
+        self.conn.commit()
+
+
+def export_sqlite(sqlitefile, scratchfiles, batch_size=1000):
+    """
+    Export or sync the passed ScratchDatabase and ScratchCrate objects
+    into the SQLite file 'sqlitefile', creating it if needed.
+
+    Every entry is a row in the 'entries' table, with one column per
+    known field key, plus its source file in 'sources'. Fields with
+    unknown keys, or that can't be decoded, are kept as raw bytes in
+    the 'entry_fields' table so nothing is lost.
+
+    Entries are matched to existing rows by their source file and track
+    path, and only rows for new or changed entries are written. Rows for
+    entries that no longer exist are deleted. Writes are batched with
+    executemany() and committed every 'batch_size' written entries.
+
+    Returns a dict of counts of 'inserted', 'updated', 'deleted' and
+    'unchanged' entries.
+    """
+    counts = collections.OrderedDict(
+            (name, 0) for name in ["inserted", "updated",
+                                   "deleted", "unchanged"])
+    columns = _known_columns()
+
+    conn = sqlite3.connect(sqlitefile)
+    try:
+        conn.execute("PRAGMA foreign_keys = ON")
+        _ensure_schema(conn, columns)
+        syncer = _Syncer(conn, [key for key, _ in columns],
+                         batch_size, counts)
+        for scratchfile in scratchfiles:
+            log.debug("Syncing %s to %s", scratchfile.filename, sqlitefile)
+            syncer.sync(scratchfile)
+    finally:
+        conn.close()
+
+    return dict(counts)
@@ -0,0 +1,95 @@
+import collections
+import time
+
+
+class LibraryStats(object):
+    """
+    Aggregate numbers about the tracks of a database or crate, returned
+    by stats() on a ScratchDatabase, ScratchCrate or SeratoLibrary.
+
+    'tracks' is the number of tracks, 'size' the total of their ufsb
+    file sizes in bytes, 'missing' the number flagged bmis and 'corrupt'
+    the number flagged bcrt or with a tcor description. 'types', 'keys'
+    and 'bpms' count tracks by ttyp, tkey and tbpm rounded to a whole
+    number, and 'added' counts tracks by the 'YYYY-MM' month of uadd.
+
+    For crates, 'unresolved' is the number of tracks that weren't found
+    in the database, which are only counted in 'tracks'.
+    """
+    def __init__(self):
+        self.tracks = 0
+        self.size = 0
+        self.missing = 0
+        self.corrupt = 0
+        self.unresolved = 0
+        self.types = collections.Counter()
+        self.keys = collections.Counter()
+        self.bpms = collections.Counter()
+        self.added = collections.Counter()
+
+    def add_track(self, ftype, size, missing, corrupt, bpm, key, added):
+        """
+        Count a track from its decoded values, any of which can be None
+        """
+        self.add_tracks([(ftype, size, missing, corrupt, bpm, key, added)])
+
+    def add_tracks(self, tracks):
+        """
+        Count many tracks at once, from tuples of add_track() arguments
+        """
+        tracks = list(tracks)
+        if not tracks:
+            return
+        ftypes, sizes, missing, corrupt, bpms, keys, added = zip(*tracks)
+        self.tracks += len(tracks)
+        self.size += sum(size for size in sizes if size)
+        self.missing += sum(map(bool, missing))
+        self.corrupt += sum(map(bool, corrupt))
+        self.types.update(ftype for ftype in ftypes if ftype)
+        self.keys.update(key for key in keys if key)
+        self.bpms.update(bpm for bpm in bpms if bpm is not None)
+
+        # Tracks are added in bursts, so only format each day once
+        days = collections.Counter(stamp // 86400 for stamp in added
+                                   if stamp is not None)
+        for day, count in days.items():
+            self.added[time.strftime("%Y-%m",
+                                     time.gmtime(day * 86400))] += count
+
+    def as_dict(self):
+        """
+        Return the numbers as a plain dict
+        """
+        return {"tracks": self.tracks, "size": self.size,
+                "missing": self.missing, "corrupt": self.corrupt,
+                "unresolved": self.unresolved,
+                "types": dict(self.types), "keys": dict(self.keys),
+                "bpms": dict(self.bpms), "added": dict(self.added)}
+
+    def report(self):
+        """
+        Return the numbers formatted as text, with BPMs grouped by tens
+        """
+        def _counts(counter):
+            return ", ".join("%s=%d" % item for item in sorted(
+                    counter.items(), key=lambda item: (-item[1], item[0])))
+
+        bpmgroups = collections.Counter()
+        for bpm, count in self.bpms.items():
+            bpmgroups[bpm // 10 * 10] += count
+
+        ret = "tracks:     %d\n" % self.tracks
+        ret += "size:       %.1f MB\n" % (self.size / 1024.0 / 1024.0)
+        ret += "missing:    %d\n" % self.missing
+        ret += "corrupt:    %d\n" % self.corrupt
+        if self.unresolved:
+            ret += "unresolved: %d\n" % self.unresolved
+        ret += "types:      %s\n" % _counts(self.types)
+        ret += "keys:       %s\n" % _counts(self.keys)
+        ret += "bpm:        %s\n" % ", ".join(
+                "%d-%d=%d" % (bpm, bpm + 9, count)
+                for bpm, count in sorted(bpmgroups.items()))
+        ret += "added:\n"
+        for month, count in sorted(self.added.items()):
+            ret += "  %s %6d\n" % (month, count)
+        return ret
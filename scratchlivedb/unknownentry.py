@@ -1,33 +1,115 @@
+import random
 
 
 class UnknownEntry(object):
     """
     Debug helper for tracking database keys we've never seen before,
     and aren't explicitly supported in the code
+
+    Only the first 'maxvalues' distinct values are kept, and for each
+    of them a random sample of at most 'maxfiles' files that have it,
+    so memory use is bounded however many entries are tracked. The
+    counts cover every occurrence.
     """
 
-    def __init__(self, key):
+    def __init__(self, key, maxvalues, maxfiles, rand):
         self.key = key
         self.values = {}
+        self.valuecounts = {}
+        self.count = 0
+        self.othercount = 0
+        self._maxvalues = maxvalues
+        self._maxfiles = maxfiles
+        self._random = rand
 
     def add_example(self, filebase, val):
         """
         Add an example value for the unknown key
         """
+        self.count += 1
         if val not in self.values:
+            if len(self.values) >= self._maxvalues:
+                self.othercount += 1
+                return
             self.values[val] = []
-        self.values[val].append(filebase)
+            self.valuecounts[val] = 0
+
+        self.valuecounts[val] += 1
+        files = self.values[val]
+        if len(files) < self._maxfiles:
+            files.append(filebase)
+            return
+
+        # Reservoir sampling, every file has the same chance to be kept
+        idx = self._random.randrange(self.valuecounts[val])
+        if idx < self._maxfiles:
+            files[idx] = filebase
 
 
 class UnknownEntryTracker(object):
-    def __init__(self):
+    """
+    Collects the unknown field keys of the entries it's passed. This is
+    opt-in diagnostics, enabled with track_unknowns=True when loading.
+
+    'convert' is called with (key, raw value) to format values for
+    report(), and defaults to repr() of the raw value.
+    """
+    def __init__(self, maxvalues=20, maxfiles=20, convert=None):
         self.unknowns = {}
+        self.maxvalues = maxvalues
+        self.maxfiles = maxfiles
+        self._convert = convert
+        # Seeded, so reports are reproducible
+        self._random = random.Random(0)
 
     def track_unknown(self, filebase, key, val):
         """
         Init an UnknownEntry for a key we've never seen before
         """
         if key not in self.unknowns:
-            self.unknowns[key] = UnknownEntry(key)
+            self.unknowns[key] = UnknownEntry(key, self.maxvalues,
+                                              self.maxfiles, self._random)
         entry = self.unknowns[key]
         entry.add_example(filebase, val)
+
+    def keys(self):
+        """
+        Return the sorted list of unknown keys seen so far
+        """
+        return sorted(self.unknowns.keys())
+
+    def _format_value(self, key, val):
+        if self._convert is None:
+            return repr(val)
+        return self._convert(key, val)
+
+    def _format_entry(self, entry):
+        """
+        Build a string listing the sampled values, which should
+        help determine what the key actually does
+        """
+        ret = "Unknown type: %s\n" % entry.key
+        for val, files in entry.values.items():
+            files = sorted(str(f) for f in files)
+            msg = ""
+            for f in files:
+                if msg:
+                    msg += "\n"
+                msg += "  %-45s" % f[-min(len(f), 45):]
+
+            others = entry.valuecounts[val] - len(files)
+            msg += " %-20s : %s" % ("(and %s others)" % others,
+                                    self._format_value(entry.key, val))
+            ret += msg + "\n"
+
+        if entry.othercount:
+            ret += "  (and %s entries with other values)\n" % entry.othercount
+        return ret + "\n"
+
+    def report(self):
+        """
+        Return a string describing every unknown key and its sampled
+        values. It's only built when this is called.
+        """
+        return "".join(self._format_entry(self.unknowns[key])
+                       for key in self.keys())
@@ -12,6 +12,9 @@ setup(
     url='https://github.com/crobinso/scratchlivedb',
 
     packages=['scratchlivedb'],
+    extras_require={
+        'numpy': ['numpy'],
+    },
     entry_points={
         'console_scripts': ['scratchlivedb-tool = scratchlivedb._cli:main'],
     },
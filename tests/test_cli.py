@@ -1,7 +1,13 @@
 
 import atexit
 import glob
+import json
 import os
+import shutil
+
+import pytest
+
+import scratchlivedb
 
 datadir = os.path.join(os.path.dirname(__file__), "data")
 basicdb = os.path.join(datadir, "basic.db")
@@ -27,20 +33,150 @@ def test_cliBasic(run_cli):
     """
     run_cli("scratchlivedb-tool dump %s" % basicdb)
 
+    out = run_cli("scratchlivedb-tool --profile dump %s" % basicdb)
+    assert "parse " in out
+
+
+def test_cliDump(run_cli):
+    """
+    Test dump field selection, filters and formats over several files
+    """
+    cratefile = os.path.join(datadir, "test.crate")
+    out = run_cli("scratchlivedb-tool dump %s %s" % (basicdb, cratefile))
+    assert len(out.splitlines()) == 50 + 38
+
+    out = run_cli("scratchlivedb-tool dump %s %s --format jsonl "
+                  "--fields path,tart,utkn --where tart~andy "
+                  "--where 'utkn<=12'" % (basicdb, cratefile))
+    assert out == ('{"path": "music/Andy_C/Andy_C_-_Nightlife_4_-_12_-_'
+                   'Culture_Shock_-_Kronix.mp3", "tart": "Andy C", '
+                   '"utkn": 12}\n')
+
+    out = run_cli("scratchlivedb-tool dump %s --format csv --fields file "
+                  "--where path~Wickaman" % cratefile)
+    assert out.splitlines()[:2] == ["file", cratefile]
+
+    out = run_cli("scratchlivedb-tool dump %s --where tbpm" % basicdb,
+                  expectfail=True)
+    assert "Invalid filter 'tbpm'" in out
+
 
 def test_cliUnknownKeys(run_cli):
     """
     Make sure unknown key detection works
     """
-    # Prevent unfinished crate support from interfering
-    # pylint: disable=protected-access
-    # Ignore 'Access to protected member'
-    from scratchlivedb.scratchdb import _unknowns
-    _unknowns.unknowns = {}
-    # pylint: enable=protected-access
-
     out = run_cli("scratchlivedb-tool dump %s" % unknowndb)
     assert "Unknown keys encountered: ['tzzz', 'uzzz', 'zzzz']" in out
 
     out = run_cli("scratchlivedb-tool --debug dump %s" % unknowndb)
     assert "Unknown type for key 'zzzz'" in out
+
+
+def test_cliExportSqlite(run_cli, tmp_path):
+    """
+    Test the export-sqlite subcommand
+    """
+    sqlitefile = str(tmp_path / "library.sqlite")
+    cratefile = os.path.join(datadir, "test.crate")
+    out = run_cli("scratchlivedb-tool export-sqlite %s %s %s" %
+                  (sqlitefile, basicdb, cratefile))
+    assert "Inserted 97, updated 0, deleted 0, unchanged 0" in out
+    out = run_cli("scratchlivedb-tool export-sqlite %s %s" %
+                  (sqlitefile, basicdb))
+    assert "unchanged 50" in out
+
+
+def test_cliFsck(run_cli, tmp_path):
+    """
+    Test the fsck subcommand
+    """
+    out = run_cli("scratchlivedb-tool fsck %s" % basicdb)
+    assert "database, 50 valid entries, 0 errors" in out
+
+    badfile = str(tmp_path / "bad.db")
+    fixedfile = str(tmp_path / "fixed.db")
+    open(badfile, "wb").write(open(basicdb, "rb").read()[:-10])
+    out = run_cli("scratchlivedb-tool fsck %s --salvage %s" %
+                  (badfile, fixedfile), expectfail=True)
+    assert "truncated 'otrk' entry" in out
+    assert "Wrote 49 entries" in out
+    run_cli("scratchlivedb-tool fsck %s" % fixedfile)
+
+
+def test_cliDiffMerge(run_cli, tmp_path):
+    """
+    Test the diff and merge subcommands
+    """
+    cratefile = os.path.join(datadir, "test.crate")
+    run_cli("scratchlivedb-tool diff %s %s" % (cratefile, cratefile))
+
+    ourfile = str(tmp_path / "ours.crate")
+    theirfile = str(tmp_path / "theirs.crate")
+    outfile = str(tmp_path / "merged.crate")
+    ours = scratchlivedb.ScratchCrate(cratefile)
+    ours.add_tracks(["ours.mp3"])
+    ours.save(ourfile)
+    theirs = scratchlivedb.ScratchCrate(cratefile)
+    theirs.remove_tracks([theirs.trackpaths[0]])
+    theirs.save(theirfile)
+
+    out = run_cli("scratchlivedb-tool diff %s %s" % (cratefile, ourfile),
+                  expectfail=True)
+    assert "+ ours.mp3\n" in out
+    assert "1 added, 0 removed, 0 changed" in out
+
+    out = run_cli("scratchlivedb-tool merge %s %s %s -o %s" %
+                  (cratefile, ourfile, theirfile, outfile))
+    assert "0 conflicts" in out
+    merged = scratchlivedb.ScratchCrate(outfile)
+    assert merged.trackpaths == theirs.trackpaths + ["ours.mp3"]
+
+    with pytest.raises(RuntimeError, match="all be databases"):
+        run_cli("scratchlivedb-tool diff %s %s" % (basicdb, cratefile))
+
+
+def test_cliDedupe(run_cli, tmp_path):
+    """
+    Test the dedupe subcommand
+    """
+    cratefile = os.path.join(datadir, "test.crate")
+    run_cli("scratchlivedb-tool dedupe %s" % cratefile)
+
+    dupfile = str(tmp_path / "dups.crate")
+    outfile = str(tmp_path / "deduped.crate")
+    crate = scratchlivedb.ScratchCrate(cratefile)
+    paths = crate.trackpaths
+    crate.entries.append(crate.make_entry("/" + paths[3]))
+    crate.save(dupfile)
+
+    out = run_cli("scratchlivedb-tool dedupe %s" % dupfile, expectfail=True)
+    assert "* %s\n  %s\n" % (paths[3], paths[3]) in out
+    assert "1 duplicate groups, 1 duplicate tracks" in out
+
+    out = run_cli("scratchlivedb-tool dedupe %s --keys ptrk -o %s" %
+                  (dupfile, outfile))
+    assert "Removed 1 tracks" in out
+    assert scratchlivedb.ScratchCrate(outfile).trackpaths == paths
+
+
+def test_cliStats(run_cli, tmp_path):
+    """
+    Test the stats subcommand on a file and on a library folder
+    """
+    out = run_cli("scratchlivedb-tool stats %s" % basicdb)
+    assert "tracks:     50\n" in out
+    assert "types:      mp3=50\n" in out
+    out = run_cli("scratchlivedb-tool stats --json %s" % basicdb)
+    # Output is stdout followed by stderr, only decode the JSON
+    results = json.JSONDecoder().raw_decode(out)[0]
+    assert results[basicdb]["types"] == {"mp3": 50}
+
+    libdir = tmp_path / "_Serato_"
+    (libdir / "Subcrates").mkdir(parents=True)
+    shutil.copy(basicdb, str(libdir / "database V2"))
+    shutil.copy(os.path.join(datadir, "test.crate"),
+                str(libdir / "Subcrates" / "Test.crate"))
+    out = run_cli("scratchlivedb-tool stats %s" % libdir)
+    assert "database V2:\ntracks:     50\n" in out
+    assert "Test.crate:\ntracks:     38\n" in out
+    assert "unresolved: 38\n" in out
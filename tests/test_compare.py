@@ -0,0 +1,93 @@
+import os
+
+import scratchlivedb
+
+datadir = os.path.join(os.path.dirname(__file__), "data")
+basicdb = os.path.join(datadir, "basic.db")
+testcratefile = os.path.join(datadir, "test.crate")
+
+
+def test_compareDiff():
+    """
+    Diff pairs entries by path and reports only the changed fields
+    """
+    old = scratchlivedb.ScratchDatabase(basicdb, lazy=True)
+    new = scratchlivedb.ScratchDatabase(basicdb, lazy=True)
+    assert not scratchlivedb.diff(old, new)
+
+    removed = new.entries.pop(3)
+    new.entries.append(new.make_entry("music/new.mp3"))
+    new.entries[5].trackartist = "New artist"
+    new.entries[6].bbgl = 1
+    new.entries[7], new.entries[8] = new.entries[8], new.entries[7]
+
+    result = scratchlivedb.diff(old, new)
+    assert [path for path, _ in result.added] == ["music/new.mp3"]
+    assert result.removed == [(removed.filebase, old.entries[3])]
+    assert [(path, fields) for path, _, _, fields in result.changed] == [
+        (old.entries[6].filebase,
+         {"tart": (old.entries[6].trackartist, "New artist")}),
+        (old.entries[7].filebase, {"bbgl": (0, 1)}),
+    ]
+    text = result.format()
+    assert "+ music/new.mp3\n" in text
+    assert "    tart: %r -> 'New artist'\n" % old.entries[6].trackartist in text
+
+
+def test_compareMerge():
+    """
+    Three-way merge of field changes, additions and deletions
+    """
+    base = scratchlivedb.ScratchCrate(testcratefile, lazy=True)
+    ours = scratchlivedb.ScratchCrate(testcratefile, lazy=True)
+    theirs = scratchlivedb.ScratchCrate(testcratefile, lazy=True)
+    paths = base.trackpaths
+
+    ours.add_tracks(["ours.mp3"])
+    theirs.add_tracks(["theirs.mp3"])
+    ours.remove_tracks([paths[0]])
+    theirs.remove_tracks([paths[1]])
+    ours.columns[2].columnwidth = "100"
+    theirs.columns[3].columnwidth = "200"
+    ours.columns[4].columnwidth = "1"
+    theirs.columns[4].columnwidth = "2"
+    ours.sortcolumn.boolreverse = 0
+    theirs.remove_tracks([paths[2]])
+    ours.tracks[1].filetrack = paths[2]
+    ours.tracks[1].trackcomment = "changed"
+
+    result = scratchlivedb.merge(base, ours, theirs)
+    merged = scratchlivedb.ScratchCrate(testcratefile)
+    merged.entries = result.entries
+    assert merged.trackpaths == [paths[2]] + paths[3:] + [
+            "ours.mp3", "theirs.mp3"]
+    assert [c.columnwidth for c in merged.columns][2:5] == [
+            "100", "200", "1"]
+    assert merged.sortcolumn.boolreverse == 0
+    assert result.conflicts == [
+        (None, "tvcw", "356", "1", "2"),
+        (paths[2], None, "present", "modified", "deleted"),
+    ]
+    assert not scratchlivedb.diff(scratchlivedb.ScratchCrate(testcratefile),
+                                  scratchlivedb.ScratchCrate(testcratefile))
+
+
+def test_compareMergeOneSided(monkeypatch):
+    """
+    Entries changed on only one side are taken whole, without merging
+    their fields
+    """
+    base = scratchlivedb.ScratchDatabase(basicdb, lazy=True)
+    ours = scratchlivedb.ScratchDatabase(basicdb, lazy=True)
+    theirs = scratchlivedb.ScratchDatabase(basicdb, lazy=True)
+    ours.entries[1].trackartist = "Ours"
+    theirs.entries[2].trackartist = "Theirs"
+
+    def _fail(*args):
+        raise AssertionError("field merge of a one-sided change")
+    monkeypatch.setattr(scratchlivedb.compare, "_merge_entry", _fail)
+    result = scratchlivedb.merge(base, ours, theirs)
+    assert result.entries[:3] == [ours.entries[0], ours.entries[1],
+                                  theirs.entries[2]]
+    assert result.entries[3:] == ours.entries[3:]
+    assert not result.conflicts
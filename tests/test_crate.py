@@ -1,6 +1,8 @@
 
 import os
 
+import pytest
+
 import scratchlivedb
 
 datadir = os.path.join(os.path.dirname(__file__), "data")
@@ -14,3 +16,61 @@ def test_crateNoChange():
     """
     db = scratchlivedb.ScratchCrate(testcratefile)
     assert db.get_final_content() == open(testcratefile, "rb").read()
+
+
+def test_cratePathIndex():
+    """
+    Crates look up tracks by their ptrk path
+    """
+    crate = scratchlivedb.ScratchCrate(testcratefile)
+    path = crate.entries[10].filetrack
+    assert crate.find_by_path(path) is crate.entries[10]
+    assert path in crate
+
+
+def test_crateRecords(tmp_path):
+    """
+    Crate records are split out by type, and bulk track changes
+    round trip through save
+    """
+    # pylint: disable=protected-access
+    # Ignore 'Access to protected member'
+    crate = scratchlivedb.ScratchCrate(testcratefile, lazy=True)
+    assert crate.sortcolumn.columnname == "song"
+    assert crate.sortcolumn.boolreverse == 1
+    assert [c.columnname for c in crate.columns][1:4] == [
+            "#", "song", "artist"]
+    assert crate.columns[2].columnwidth == "589"
+    assert len(crate.tracks) == 38
+    assert crate.trackpaths[0] == crate.tracks[0].filetrack
+    assert crate.tracks[0].filetrack.startswith("music/Wickaman/")
+
+    paths = crate.trackpaths
+    assert crate.add_tracks([paths[0], "/music/new.mp3",
+                             "music/new.mp3"]) == 1
+    assert crate.trackpaths[-1] == "/music/new.mp3"
+    assert crate.tracks[-1]._rawdict is None
+    crate.entries.append(crate.make_entry(paths[1]))
+    assert crate.dedupe_tracks() == 1
+    crate.entries.append(crate.tracks[0])
+    assert crate.dedupe_tracks() == 1
+    assert crate.trackpaths[0] == paths[0]
+    assert crate.remove_tracks([paths[2], paths[3], "missing.mp3"]) == 2
+    assert crate.trackpaths == paths[:2] + paths[4:] + ["/music/new.mp3"]
+
+    content = crate.get_final_content()
+    outfile = str(tmp_path / "test.crate")
+    crate.save(outfile)
+    assert open(outfile, "rb").read() == content
+    assert scratchlivedb.ScratchCrate(outfile).trackpaths == crate.trackpaths
+
+
+def test_crateUnknownRecord():
+    """
+    Unknown record names are a parse error
+    """
+    # pylint: disable=protected-access
+    # Ignore 'Access to protected member'
+    content = open(testcratefile, "rb").read().replace(b"ovct", b"oxxx", 1)
+    with pytest.raises(scratchlivedb.ScratchParseError):
+        scratchlivedb.scratchdb._make_record(content, content.index(b"oxxx"))
@@ -1,10 +1,16 @@
+import io
 import os
+import shutil
+import sys
+
+import pytest
 
 import scratchlivedb
 
 datadir = os.path.join(os.path.dirname(__file__), "data")
 basicdb = os.path.join(datadir, "basic.db")
 emptydb = os.path.join(datadir, "empty.db")
+unknowndb = os.path.join(datadir, "unknown_keys.db")
 
 
 
@@ -58,23 +64,24 @@ def test_dbDBDocString():
     the DB doc string and DB properties are in sync.
     """
     db = scratchlivedb.ScratchDatabase(basicdb)
-    doc = db.entries[0].__doc__
+    assert db.entries[0].__class__.__name__ == "_ScratchFileEntry"
 
     # pylint: disable=protected-access
     # Ignore 'Access to protected member'
     rawkeys = scratchlivedb.scratchdb._seen[:]
+    classes = scratchlivedb.scratchdb._record_classes.values()
     # pylint: enable=protected-access
 
-    dockeys = []
-    for line in doc.splitlines():
-        line = line.strip("\n").strip()
-        if line[4:6] != " :":
-            continue
-        dockeys.append(line.split(" :")[0])
+    dockeys = set()
+    for cls in classes:
+        for line in cls.__doc__.splitlines():
+            line = line.strip("\n").strip()
+            if line[4:6] != " :":
+                continue
+            dockeys.add(line.split(" :")[0])
 
-    dockeys.sort()
     rawkeys.sort()
-    assert dockeys == rawkeys
+    assert sorted(dockeys) == rawkeys
 
 
 def test_dbNonAscii():
@@ -122,3 +129,547 @@ def test_dbAddToDB():
     final = empty.get_final_content()
     appended_db = open("tests/data/appended.db", "rb").read()
     assert final == appended_db
+
+
+def test_dbLazy():
+    """
+    Lazy loading shouldn't split fields until they are used, and should
+    give the same results as a full parse
+    """
+    # pylint: disable=protected-access
+    db = scratchlivedb.ScratchDatabase(basicdb, lazy=True)
+    full = scratchlivedb.ScratchDatabase(basicdb)
+    assert db.entries[0]._rawdict is None
+    assert db.get_final_content() == open(basicdb, "rb").read()
+    assert db.entries[0]._rawdict is None
+
+    assert [e.filebase for e in db.entries] == [
+        e.filebase for e in full.entries]
+    assert list(db.entries[0]._rawdict) == list(full.entries[0]._rawdict)
+    assert not hasattr(db.entries[0], "__dict__")
+
+    db.entries[5].tracktitle = "Changed title"
+    full.entries[5].tracktitle = "Changed title"
+    fresh = scratchlivedb.ScratchDatabase(basicdb, lazy=True)
+    fresh.entries[5].tracktitle = "Changed title"
+    assert fresh.entries[5]._rawdict is None
+    assert fresh.get_final_content() == full.get_final_content()
+    assert db.get_final_content() == full.get_final_content()
+    assert db.get_final_content() != open(basicdb, "rb").read()
+
+
+def test_dbIterEntries():
+    """
+    Streaming entries should match a full load, and check the header
+    before any entries are read
+    """
+    db = scratchlivedb.ScratchDatabase(basicdb)
+    entries = list(scratchlivedb.ScratchDatabase.iter_entries(basicdb))
+    assert len(entries) == len(db.entries)
+    assert ([e.get_final_content() for e in entries] ==
+            [e.get_final_content() for e in db.entries])
+    assert entries[-1].filebase == db.entries[-1].filebase
+
+    assert list(scratchlivedb.ScratchDatabase.iter_entries(emptydb)) == []
+
+    cratefile = os.path.join(datadir, "test.crate")
+    with pytest.raises(scratchlivedb.ScratchParseError):
+        scratchlivedb.ScratchDatabase.iter_entries(cratefile)
+
+
+def test_dbDecodeCache():
+    """
+    Decoded property values are cached until the property is set
+    """
+    # pylint: disable=protected-access
+    # Ignore 'Access to protected member'
+    db = scratchlivedb.ScratchDatabase(basicdb, lazy=True)
+    entry = db.entries[3]
+    assert entry._decoded is None
+    artist = entry.trackartist
+    assert entry._decoded == {"tart": artist}
+    assert entry.trackartist is artist
+
+    entry.trackartist = "New artist"
+    assert "tart" not in entry._decoded
+    assert entry.trackartist == "New artist"
+    entry._set_raw("tart", b"\0X")
+    assert entry.trackartist == "X"
+
+    db = scratchlivedb.ScratchDatabase(basicdb, decode_cache=False)
+    assert db.entries[3].trackartist == artist
+    assert db.entries[3]._decoded is False
+    entries = scratchlivedb.ScratchDatabase.iter_entries(
+            basicdb, decode_cache=False)
+    entry = next(entries)
+    assert entry.filebase == db.entries[0].filebase
+    assert entry._decoded is False
+
+
+def test_dbUnknowns():
+    """
+    Unknown key tracking is opt-in, per load, and bounded
+    """
+    assert scratchlivedb.ScratchDatabase(unknowndb).unknowns is None
+
+    db = scratchlivedb.ScratchDatabase(unknowndb, lazy=True,
+                                       track_unknowns=True)
+    tracker = db.unknowns
+    assert tracker.keys() == ["tzzz", "uzzz", "zzzz"]
+    assert tracker.unknowns["uzzz"].count == 12
+    assert db.entries[0]._rawdict is None  # pylint: disable=protected-access
+    report = tracker.report()
+    assert "Unknown type: zzzz" in report
+
+    tracker = scratchlivedb.unknownentry.UnknownEntryTracker(
+            maxvalues=2, maxfiles=3)
+    for idx in range(100):
+        tracker.track_unknown("file%d" % idx, "uzzz", idx % 5)
+    entry = tracker.unknowns["uzzz"]
+    assert entry.count == 100
+    assert entry.valuecounts == {0: 20, 1: 20}
+    assert entry.othercount == 60
+    assert [len(files) for files in entry.values.values()] == [3, 3]
+    assert "(and 60 entries with other values)" in tracker.report()
+
+
+def test_dbProfile():
+    """
+    Test the opt-in profiling counters and callback
+    """
+    assert scratchlivedb.ScratchDatabase(basicdb).profile is None
+
+    calls = []
+    profile = scratchlivedb.Profile(
+            callback=lambda *args: calls.append(args[0]))
+    db = scratchlivedb.ScratchDatabase(basicdb, lazy=True, profile=profile)
+    assert db.profile is profile
+    assert list(profile.phases) == ["read", "header", "parse"]
+    assert profile.phases["read"]["bytes"] == os.path.getsize(basicdb)
+    assert profile.phases["parse"]["entries"] == len(db.entries)
+
+    artists = [e.trackartist for e in scratchlivedb.ScratchDatabase(
+            basicdb).entries if e.trackartist is not None]
+    for entry in db.entries:
+        _ = entry.trackartist
+        _ = entry.trackartist
+    db.query(ttyp="mp3")
+    db.get_final_content()
+    assert profile.decodes["tart"] == len(artists)
+    assert profile.decodes["ttyp"] == len(db.entries)
+    assert calls == ["read", "header", "parse", "field index", "serialize"]
+    assert profile.as_dict()["phases"]["serialize"]["calls"] == 1
+    assert "field index" in profile.report()
+
+    profile = scratchlivedb.Profile()
+    entries = list(scratchlivedb.ScratchDatabase.iter_entries(
+            basicdb, profile=profile))
+    assert profile.phases["parse"]["entries"] == len(entries)
+
+
+def test_dbMmap():
+    """
+    Test the mmap backed mode and its context manager
+    """
+    # pylint: disable=protected-access
+    rawbasic = open(basicdb, "rb").read()
+    with scratchlivedb.ScratchDatabase(basicdb, lazy=True, mmap=True) as db:
+        assert db._mapping is not None
+        assert db.get_final_content() == rawbasic
+        entry = db.entries[3]
+        assert entry.filebase
+    assert db._mapping is None
+
+    # Fields that were loaded stay usable after close
+    assert entry.filebase
+    db.close()
+
+
+def test_dbSave(tmp_path):
+    """
+    Test write_to() and save() output
+    """
+    rawbasic = open(basicdb, "rb").read()
+    db = scratchlivedb.ScratchDatabase(basicdb, lazy=True)
+    db.entries[1].tracktitle = "Saved title"
+
+    out = io.BytesIO()
+    db.write_to(out)
+    assert out.getvalue() == db.get_final_content()
+    assert out.getvalue() != rawbasic
+
+    outfile = str(tmp_path / "saved.db")
+    db.save(outfile)
+    assert open(outfile, "rb").read() == out.getvalue()
+    assert scratchlivedb.ScratchDatabase(
+            outfile).entries[1].tracktitle == "Saved title"
+
+    # New files get the usual mode for the umask, existing ones keep theirs
+    umask = os.umask(0o022)
+    try:
+        newfile = str(tmp_path / "new.db")
+        db.save(newfile)
+        assert os.stat(newfile).st_mode & 0o777 == 0o644
+        os.chmod(newfile, 0o640)
+        db.save(newfile)
+        assert os.stat(newfile).st_mode & 0o777 == 0o640
+    finally:
+        os.umask(umask)
+
+
+def test_dbSaveAtomic(tmp_path, monkeypatch):
+    """
+    Test save() backup rotation, and that a failed save leaves the
+    original file alone
+    """
+    dbfile = str(tmp_path / "database V2")
+    shutil.copy(basicdb, dbfile)
+
+    db = scratchlivedb.ScratchDatabase(dbfile, lazy=True, mmap=True)
+    for idx in range(3):
+        db.entries[0].tracktitle = "Title %d" % idx
+        db.save(backups=2)
+    db.close()
+
+    def _title(path):
+        return scratchlivedb.ScratchDatabase(path).entries[0].tracktitle
+    assert _title(dbfile) == "Title 2"
+    assert _title(dbfile + ".bak") == "Title 1"
+    assert _title(dbfile + ".bak.1") == "Title 0"
+    assert not os.path.exists(dbfile + ".bak.2")
+
+    db = scratchlivedb.ScratchDatabase(basicdb)
+    def _fail(*args):
+        raise RuntimeError("fake failure")
+    db.entries[10].tracktitle = "Never saved"
+    monkeypatch.setattr(type(db.entries[10]), "get_final_content", _fail)
+    with pytest.raises(RuntimeError):
+        db.save(dbfile)
+    assert _title(dbfile) == "Title 2"
+    assert sorted(os.listdir(str(tmp_path))) == [
+        "database V2", "database V2.bak", "database V2.bak.1"]
+
+
+def test_dbIncrementalSave(tmp_path):
+    """
+    With append=True appending entries should append to the file in
+    place, other changes should rewrite it
+    """
+    dbfile = str(tmp_path / "database V2")
+    shutil.copy(emptydb, dbfile)
+    origino = os.stat(dbfile).st_ino
+
+    basic = scratchlivedb.ScratchDatabase(basicdb)
+    db = scratchlivedb.ScratchDatabase(dbfile)
+    db.entries.append(basic.entries[10])
+    db.save(append=True)
+    db.entries.append(basic.entries[20])
+    newentry = db.make_entry("foo/some/file/path")
+    newentry.tracktitle = "Hey a track title"
+    newentry.inttimeadded = 1335865095
+    newentry.inttimemodified = 1335865095
+    db.entries.append(newentry)
+    db.save(append=True)
+
+    assert os.stat(dbfile).st_ino == origino
+    appended_db = open(os.path.join(datadir, "appended.db"), "rb").read()
+    assert open(dbfile, "rb").read() == appended_db
+
+    # Without append=True, appending is an atomic rewrite too
+    db.entries.append(basic.entries[30])
+    db.save()
+    assert os.stat(dbfile).st_ino != origino
+    origino = os.stat(dbfile).st_ino
+
+    # Modifying an entry, or any non-append list change, is a full rewrite
+    db.entries[2].tracktitle = "New title"
+    db.save(append=True)
+    assert os.stat(dbfile).st_ino != origino
+    newino = os.stat(dbfile).st_ino
+    db.entries.reverse()
+    db.save()
+    assert os.stat(dbfile).st_ino != newino
+
+    reloaded = scratchlivedb.ScratchDatabase(dbfile)
+    assert reloaded.entries[1].tracktitle == "New title"
+    assert reloaded.get_final_content() == db.get_final_content()
+
+
+def test_dbPathIndex():
+    """
+    Test path lookups, and that the index follows entry changes
+    """
+    db = scratchlivedb.ScratchDatabase(basicdb, lazy=True)
+    entry = db.entries[7]
+    path = entry.filebase
+    assert db.find_by_path(path) is entry
+    assert db.find_by_path("/" + path) is entry
+    assert path in db
+    assert "no/such/file.mp3" not in db
+    assert db.find_by_path("no/such/file.mp3") is None
+
+    newentry = db.make_entry("foo/new.mp3")
+    db.entries.append(newentry)
+    assert db.find_by_path("foo/new.mp3") is newentry
+
+    entry.filebase = "foo/renamed.mp3"
+    assert path not in db
+    assert db.find_by_path("foo/renamed.mp3") is entry
+
+    replacement = db.make_entry("foo/replacement.mp3")
+    db.replace_path("foo/renamed.mp3", replacement)
+    assert db.entries[7] is replacement
+    assert "foo/renamed.mp3" not in db
+    assert db.find_by_path("foo/replacement.mp3") is replacement
+    with pytest.raises(KeyError):
+        db.replace_path("foo/renamed.mp3", entry)
+
+    # With duplicates the replacement of the first one is found first,
+    # whether it keeps the path or takes one that is further down
+    dup = db.make_entry(db.entries[2].filebase)
+    db.entries.append(dup)
+    samepath = db.make_entry(dup.filebase)
+    db.replace_path(dup.filebase, samepath)
+    assert db.entries[2] is samepath
+    assert db.find_by_path(dup.filebase) is samepath
+    movedpath = db.make_entry(dup.filebase)
+    db.replace_path(db.entries[1].filebase, movedpath)
+    assert db.find_by_path(dup.filebase) is movedpath
+
+    count = len(db.entries)
+    assert db.remove_path("foo/new.mp3") == 1
+    assert db.remove_path("foo/new.mp3") == 0
+    assert len(db.entries) == count - 1
+    assert "foo/new.mp3" not in db
+
+    db.entries = db.entries[:5]
+    assert "foo/replacement.mp3" not in db
+    assert db.entries[0].filebase in db
+
+
+def test_dbDuplicates():
+    """
+    Test duplicate groups by path and by other fields, and collapsing them
+    """
+    # pylint: disable=protected-access
+    # Ignore 'Access to protected member'
+    db = scratchlivedb.ScratchDatabase(basicdb, lazy=True)
+    assert db.find_duplicates() == []
+    count = len(db.entries)
+
+    pathdup = db.make_entry("/" + db.entries[5].filebase)
+    fielddup = db.make_entry("elsewhere/copy.mp3")
+    for key in ["utkn", "tart", "tsng"]:
+        fielddup._set_raw(key, db.entries[3]._get_raw(key))
+    fuller = scratchlivedb.scratchdb._make_record(
+            db.entries[10].get_final_content())
+    fuller.trackcomment = "extra field"
+    db.entries += [pathdup, fielddup, fuller]
+
+    assert db.find_duplicates() == [
+        [db.entries[5], pathdup], [fuller, db.entries[10]]]
+    assert db.find_duplicates(["utkn", "tart", "tsng"]) == [
+        [db.entries[3], fielddup], [fuller, db.entries[10]]]
+    assert len(db.find_duplicates(["tart"])) == 5
+
+    oldentry = db.entries[10]
+    assert db.dedupe() == 2
+    assert len(db.entries) == count + 1
+    assert fuller in db.entries and oldentry not in db.entries
+    assert db.find_by_path(fuller.filebase) is fuller
+    assert db.dedupe(["utkn", "tart", "tsng"]) == 1
+    assert db.entries[-1] is fuller
+    assert db.find_duplicates(["utkn", "tart", "tsng"]) == []
+
+    # The same entry object in the list twice loses only one copy
+    db = scratchlivedb.ScratchDatabase(basicdb, lazy=True)
+    first = db.entries[0]
+    db.entries.append(first)
+    assert db.dedupe() == 1
+    assert len(db.entries) == count
+    assert db.entries[0] is first
+    assert db.find_by_path(first.filebase) is first
+
+
+def test_dbStats():
+    """
+    Test the stats of a database, and that only their fields are decoded
+    """
+    db = scratchlivedb.ScratchDatabase(basicdb, lazy=True, profile=True)
+    db.entries[0].boolmissing = 1
+    db.entries[1].trackcorrupt = "bad frames"
+    db.entries[2].intfilesize = 5000
+    db.entries[3].intfilesize = 7000
+    db.entries[3].trackkey = "8A"
+    db.entries[4].trackbpm = "127.6"
+    db.entries[5].trackbpm = "0.00"
+    db.entries[6].tracktype = "flac"
+    db.entries[6].trackbpm = "inf"
+
+    stats = db.stats()
+    assert stats.tracks == 50
+    assert stats.size == 12000
+    assert stats.missing == 1
+    assert stats.corrupt == 1
+    assert stats.types == {"mp3": 49, "flac": 1}
+    assert stats.keys == {"8A": 1}
+    assert stats.bpms[128] == 1 and 0 not in stats.bpms
+    assert sum(stats.added.values()) == 50
+    assert stats.added["2011-08"] == 16
+    assert "bpm:        80-89=2, 110-119=1, 120-129=1" in stats.report()
+    assert db.profile.phases["stats"]["entries"] == 50
+    assert all(entry._rawdict is None for entry in db.entries[7:])
+
+    # Track stats are kept, and only changed or new tracks are decoded
+    assert db.stats().as_dict() == stats.as_dict()
+    assert db.profile.phases["track stats"]["entries"] == 50
+    db.entries.append(db.make_entry("music/new.mp3"))
+    assert db.stats().tracks == 51
+    assert db.profile.phases["track stats"]["entries"] == 51
+    db.entries[8].trackkey = "1A"
+    assert db.stats().keys == {"8A": 1, "1A": 1}
+    assert db.profile.phases["track stats"]["entries"] == 102
+
+
+def test_dbQuery():
+    """
+    Test query() against a brute force search, and that its indexes
+    follow writes and appends
+    """
+    # pylint: disable=protected-access
+    db = scratchlivedb.ScratchDatabase(basicdb, lazy=True)
+    full = scratchlivedb.ScratchDatabase(basicdb)
+
+    def _bpm(entry):
+        try:
+            return float(entry.trackbpm)
+        except (TypeError, ValueError):
+            return None
+
+    expect = [e.filebase for e in full.entries
+              if e.trackgenre == "Drum + Bass" and
+              _bpm(e) is not None and 170 <= _bpm(e) <= 175 and
+              e.inttimeadded >= 1300000000]
+    found = db.query(select="pfil", tgen="Drum + Bass",
+                     tbpm=(170, 175), uadd=(1300000000, None))
+    assert expect and found == expect
+    assert all(e._rawdict is None for e in db.entries)
+
+    assert db.query() == db.entries
+    assert db.query(tgen="No such genre") == []
+
+    entry = db.query(tgen="Drum + Bass")[0]
+    entry.trackgenre = "Jungle"
+    assert db.query(tgen="Jungle") == [entry]
+    assert entry not in db.query(tgen="Drum + Bass")
+
+    newentry = db.make_entry("foo/new.mp3")
+    newentry.trackbpm = "172.50"
+    db.entries.append(newentry)
+    assert db.query(tbpm=(172.5, 172.5)) == [newentry]
+
+
+def test_dbToColumns(monkeypatch):
+    """
+    Test the numpy columnar export
+    """
+    monkeypatch.setitem(sys.modules, "numpy", None)
+    db = scratchlivedb.ScratchDatabase(basicdb, lazy=True)
+    with pytest.raises(ImportError):
+        db.to_columns(["uadd"])
+    monkeypatch.undo()
+
+    pytest.importorskip("numpy")
+    full = scratchlivedb.ScratchDatabase(basicdb)
+    newentry = db.make_entry("foo/new.mp3")
+    db.entries.append(newentry)
+    full.entries.append(newentry)
+
+    cols = db.to_columns(["uadd", "bmis", "sbav", "tbpm", "tcom"])
+    assert cols["uadd"].tolist() == [e.inttimeadded for e in full.entries]
+    assert cols["bmis"].tolist() == [bool(e.boolmissing)
+                                     for e in full.entries[:-1]] + [None]
+    assert cols["bmis"].dtype == bool
+    assert cols["sbav"].tolist() == [e.sbav for e in full.entries]
+    assert cols["tbpm"].tolist() == [e.trackbpm for e in full.entries]
+    assert cols["tcom"].tolist() == [e.trackcomment for e in full.entries]
+    assert cols["tcom"].mask.any()
+
+
+def test_dbSidecarCache(tmp_path, monkeypatch):
+    """
+    Test reusing the sidecar cache for unchanged and appended files,
+    and ignoring it for rewritten files
+    """
+    # pylint: disable=protected-access
+    dbfile = str(tmp_path / "database V2")
+    cachefile = dbfile + ".slcache"
+    shutil.copy(basicdb, dbfile)
+    rawbasic = open(basicdb, "rb").read()
+
+    db = scratchlivedb.ScratchDatabase(dbfile, lazy=True, cache=True)
+    assert os.path.exists(cachefile)
+    expect = db.query(tgen="Drum + Bass")
+    db.write_cache()
+
+    # Reopening builds the entries from the cached spans, without
+    # parsing a single entry header
+    spans = [(e._start, e._end) for e in db.entries]
+    calls = []
+    unpack_field = scratchlivedb.scratchdb._unpack_field
+    monkeypatch.setattr(scratchlivedb.scratchdb, "_unpack_field",
+                        lambda *args: calls.append(args) or
+                        unpack_field(*args))
+    db = scratchlivedb.ScratchDatabase(dbfile, lazy=True, cache=True)
+    assert calls == []
+    assert [(e._start, e._end) for e in db.entries] == spans
+    monkeypatch.undo()
+    assert db._cachedpaths is not None
+    assert ("tgen", False) in db._fieldindexes
+    assert db.get_final_content() == rawbasic
+    assert (db.query(select="pfil", tgen="Drum + Bass") ==
+            [e.filebase for e in expect])
+    assert all(e._rawdict is None for e in db.entries)
+    assert db.entries[3].filebase in db
+
+    # Appended files only parse the new entries
+    db.entries.append(db.make_entry("foo/new.mp3"))
+    db.save()
+    db = scratchlivedb.ScratchDatabase(dbfile, lazy=True, cache=True)
+    assert len(db.entries) == 51
+    assert db.find_by_path("foo/new.mp3") is db.entries[-1]
+    assert db.query(tgen="Drum + Bass")[0].filebase == expect[0].filebase
+    newcontent = db.get_final_content()
+
+    # Reloading after the tail parse uses the refreshed cache
+    db = scratchlivedb.ScratchDatabase(dbfile, lazy=True, cache=True)
+    assert db.get_final_content() == newcontent
+    assert db.find_by_path("foo/new.mp3") is db.entries[-1]
+
+    # Rewritten files ignore the cache
+    db.entries.pop(0)
+    db.save()
+    db = scratchlivedb.ScratchDatabase(dbfile, lazy=True, cache=True)
+    assert len(db.entries) == 50
+    assert db.find_by_path("foo/new.mp3") is db.entries[-1]
+
+    # Indexes built before entries were appended only cover the
+    # entries they were built for
+    for append in [True, False]:
+        shutil.copy(basicdb, dbfile)
+        db = scratchlivedb.ScratchDatabase(dbfile, lazy=True, cache=True)
+        assert db.query(tart="ZZUNIQUE") == []
+        newentry = db.make_entry("foo/unique.mp3")
+        newentry.trackartist = "ZZUNIQUE"
+        db.entries.append(newentry)
+        db.save(append=append)
+        db.write_cache()
+        db = scratchlivedb.ScratchDatabase(dbfile, lazy=True, cache=True)
+        assert ("tart", False) in db._fieldindexes
+        assert [e.filebase for e in db.query(tart="ZZUNIQUE")] == [
+            "foo/unique.mp3"]
+
+    cachedir = tmp_path / "cachedir"
+    cachedir.mkdir()
+    db = scratchlivedb.ScratchDatabase(dbfile, cache_dir=str(cachedir))
+    assert len(os.listdir(str(cachedir))) == 1
@@ -0,0 +1,59 @@
+import io
+import os
+
+import pytest
+
+from scratchlivedb import export
+
+datadir = os.path.join(os.path.dirname(__file__), "data")
+basicdb = os.path.join(datadir, "basic.db")
+testcratefile = os.path.join(datadir, "test.crate")
+
+
+def test_exportFilters():
+    """
+    Filter parsing, and matching across databases and crates
+    """
+    assert export.parse_filter("tbpm>=120") == ("tbpm", ">=", "120")
+    assert export.parse_filter("tart=a=b") == ("tart", "=", "a=b")
+    assert export.parse_filter("path!=x") == ("path", "!=", "x")
+    for expr in ["tart", "=foo", "xx=1"]:
+        with pytest.raises(ValueError):
+            export.parse_filter(expr)
+
+    filenames = [basicdb, testcratefile]
+    rows = list(export.iter_rows(
+            filenames, ["path", "tart", "utkn", "file"],
+            [export.parse_filter("tart~andy"),
+             export.parse_filter("utkn<=12")]))
+    assert rows == [[
+        "music/Andy_C/Andy_C_-_Nightlife_4_-_12_-_Culture_Shock_-_Kronix.mp3",
+        "Andy C", 12, basicdb]]
+
+    rows = list(export.iter_rows(filenames, ["file", "tbpm"]))
+    assert len(rows) == 50 + 38
+    assert rows[-1] == [testcratefile, None]
+    rows = list(export.iter_rows(filenames, ["file"],
+                                 [export.parse_filter("tbpm!=120")]))
+    assert len(rows) == 50 + 38
+
+
+def test_exportFormats():
+    """
+    Every output format, with missing values and quoting
+    """
+    fields = ["tart", "tbpm"]
+    rows = [["Noisia", "174.00"], ["A, \"B\"\tC", None]]
+
+    def _write(fmt):
+        out = io.StringIO()
+        export.write_rows(out, iter(rows), fields, fmt)
+        return out.getvalue()
+
+    assert _write("text") == "Noisia\t174.00\nA, \"B\"\tC\t\n"
+    assert _write("csv") == ('tart,tbpm\nNoisia,174.00\n'
+                             '"A, ""B""\tC",\n')
+    assert _write("tsv") == ('tart\ttbpm\nNoisia\t174.00\n'
+                             '"A, ""B""\tC"\t\n')
+    assert _write("jsonl") == ('{"tart": "Noisia", "tbpm": "174.00"}\n'
+                               '{"tart": "A, \\"B\\"\\tC", "tbpm": null}\n')
@@ -0,0 +1,84 @@
+import os
+
+import scratchlivedb
+
+datadir = os.path.join(os.path.dirname(__file__), "data")
+basicdb = os.path.join(datadir, "basic.db")
+testcratefile = os.path.join(datadir, "test.crate")
+
+
+def _field(key, raw):
+    return key.encode("utf-8") + len(raw).to_bytes(4, "big") + raw
+
+
+def _record(name, data):
+    return name.encode("utf-8") + len(data).to_bytes(4, "big") + data
+
+
+def test_fsckValid():
+    """
+    The test files are all valid
+    """
+    for filename in os.listdir(datadir):
+        report = scratchlivedb.validate(os.path.join(datadir, filename))
+        assert report.ok, (filename, report.errors)
+
+    report = scratchlivedb.validate(testcratefile)
+    assert report.filetype == "crate"
+    assert report.entries == 47
+
+
+def test_fsckErrors(tmp_path):
+    """
+    Every problem is reported, and the valid entries can be salvaged
+    """
+    raw = open(basicdb, "rb").read()
+    db = scratchlivedb.ScratchDatabase(basicdb)
+    header = raw[:len(raw) - len(b"".join(
+            e.get_final_content() for e in db.entries))]
+    entries = [e.get_final_content() for e in db.entries[:4]]
+
+    dup = _record("otrk", _field("pfil", b"\0a") + _field("tsng", b"\0b") +
+                  _field("pfil", b"\0c"))
+    overrun = _record("otrk", _field("pfil", b"\0a")[:-1])
+    content = (header + entries[0] + b"oxxx" + entries[1][4:] + dup +
+               entries[2] + overrun + entries[3] + entries[3][:20])
+    badfile = str(tmp_path / "bad.db")
+    open(badfile, "wb").write(content)
+
+    fixedfile = str(tmp_path / "fixed.db")
+    umask = os.umask(0o022)
+    try:
+        report = scratchlivedb.validate(badfile, salvage=fixedfile)
+    finally:
+        os.umask(umask)
+    assert os.stat(fixedfile).st_mode & 0o777 == 0o644
+    assert not report.ok
+    assert [msg.split(" ")[:2] for _, msg in report.errors] == [
+        ["unknown", "entry"], ["duplicate", "field"],
+        ["field", "'pfil'"], ["truncated", "'otrk'"]]
+    assert report.errors[0][0] == len(header) + len(entries[0])
+    assert report.entries == report.salvaged == 4
+
+    fixed = scratchlivedb.ScratchDatabase(fixedfile)
+    assert [e.get_final_content() for e in fixed.entries] == [
+        entries[0], fixed.entries[1].get_final_content(),
+        entries[2], entries[3]]
+    assert fixed.entries[1].filebase == "a"
+    assert fixed.entries[1].tracktitle == "b"
+    assert scratchlivedb.validate(fixedfile).ok
+
+    # A crate record in a database is reported and left out
+    column = _record("ovct", _field("tvcn", b"\0a"))
+    open(badfile, "wb").write(header + entries[0] + column + entries[1])
+    report = scratchlivedb.validate(badfile, salvage=fixedfile)
+    assert [msg.split(" ")[:2] for _, msg in report.errors] == [
+        ["unexpected", "'ovct'"]]
+    assert report.entries == report.salvaged == 2
+    assert scratchlivedb.validate(fixedfile).ok
+    assert len(scratchlivedb.ScratchDatabase(fixedfile).entries) == 2
+
+    open(badfile, "wb").write(b"garbage")
+    report = scratchlivedb.validate(badfile)
+    assert report.filetype is None
+    assert len(report.errors) == 1
@@ -0,0 +1,169 @@
+import os
+import shutil
+import unicodedata
+
+import pytest
+
+import scratchlivedb
+
+datadir = os.path.join(os.path.dirname(__file__), "data")
+basicdb = os.path.join(datadir, "basic.db")
+testcratefile = os.path.join(datadir, "test.crate")
+
+
+def _make_library(tmp_path):
+    """
+    Build a library folder with a few crates, pointing some tracks
+    at database entries
+    """
+    libdir = tmp_path / "_Serato_"
+    cratedir = libdir / "Subcrates"
+    cratedir.mkdir(parents=True)
+    shutil.copy(basicdb, str(libdir / "database V2"))
+
+    db = scratchlivedb.ScratchDatabase(basicdb)
+    for idx, name in enumerate(["Zebra", "Alpha", "Mid%%Sub"]):
+        crate = scratchlivedb.ScratchCrate(testcratefile)
+        crate.entries[10 + idx].filetrack = db.entries[idx].filebase
+        crate.save(str(cratedir / (name + ".crate")))
+    return str(libdir), db
+
+
+def test_libraryLoad(tmp_path):
+    """
+    Parallel and serial loading give the same result, and crate tracks
+    resolve against the database
+    """
+    libdir, db = _make_library(tmp_path)
+
+    serial = scratchlivedb.SeratoLibrary(libdir, workers=1)
+    parallel = scratchlivedb.SeratoLibrary(libdir, workers=4, lazy=True)
+    assert list(serial.crates) == ["Alpha", "Mid%%Sub", "Zebra"]
+    assert list(parallel.crates) == list(serial.crates)
+    for f1, f2 in zip(serial.get_files(), parallel.get_files()):
+        assert f1.filename == f2.filename
+        assert f1.get_final_content() == f2.get_final_content()
+
+    resolved = parallel.resolve("Mid%%Sub")
+    assert len(resolved) == 38
+    assert resolved[3].filebase == db.entries[2].filebase
+    assert [e for e in resolved if e is not None] == [resolved[3]]
+    assert serial.resolve(serial.crates["Alpha"])[2].filebase == (
+            db.entries[1].filebase)
+
+    with scratchlivedb.SeratoLibrary(libdir, mmap=True) as lib:
+        assert len(lib.get_files()) == 4
+
+
+def test_libraryStats(tmp_path, monkeypatch):
+    """
+    Library stats count crate tracks from their database entries, the
+    same however the library was loaded
+    """
+    # pylint: disable=protected-access
+    # Ignore 'Access to protected member'
+    libdir, db = _make_library(tmp_path)
+    serial = scratchlivedb.SeratoLibrary(libdir, workers=1).stats()
+    parallel = scratchlivedb.SeratoLibrary(libdir, workers=4,
+                                           lazy=True).stats()
+    assert list(serial) == [os.path.join(libdir, "database V2")] + [
+        os.path.join(libdir, "Subcrates", name + ".crate")
+        for name in ["Alpha", "Mid%%Sub", "Zebra"]]
+    assert ([s.as_dict() for s in serial.values()] ==
+            [s.as_dict() for s in parallel.values()])
+
+    dbstats, cratestats = list(serial.values())[:2]
+    assert dbstats.as_dict() == db.stats().as_dict()
+    assert cratestats.tracks == 38
+    assert cratestats.unresolved == 37
+    assert cratestats.types == {"mp3": 1}
+    assert sum(cratestats.added.values()) == 1
+
+    # Each database track is decoded once, not once per crate
+    calls = []
+    track_stats = scratchlivedb.scratchdb._track_stats
+    def _count(entry, strings):
+        calls.append(entry)
+        return track_stats(entry, strings)
+    monkeypatch.setattr(scratchlivedb.scratchdb, "_track_stats", _count)
+    scratchlivedb.SeratoLibrary(libdir, lazy=True).stats()
+    assert len(calls) == 50
+
+
+def test_libraryRelocate(tmp_path, monkeypatch):
+    """
+    Relocate paths across the database and crates, and make sure a
+    failed write leaves every file alone
+    """
+    libdir, db = _make_library(tmp_path)
+    library = scratchlivedb.SeratoLibrary(libdir, lazy=True)
+    oldpath = db.entries[0].filebase
+
+    # A failure writing any file means none are replaced
+    dbfile = os.path.join(libdir, "database V2")
+    original = open(dbfile, "rb").read()
+    def _fail(*args):
+        raise RuntimeError("fake failure")
+    crate = library.crates["Zebra"]
+    monkeypatch.setattr(crate, "_write_temp", _fail)
+    with pytest.raises(RuntimeError):
+        library.relocate("music", "Volumes/New/music")
+    assert open(dbfile, "rb").read() == original
+    assert sorted(os.listdir(libdir)) == ["Subcrates", "database V2"]
+    monkeypatch.undo()
+
+    # A failed rename leaves no temporary files behind
+    library = scratchlivedb.SeratoLibrary(libdir, lazy=True)
+    replace_file = scratchlivedb.scratchdb._replace_file
+    replaced = []
+    def _fail_second(tmpname, filename, backups):
+        if replaced:
+            raise RuntimeError("fake failure")
+        replaced.append(filename)
+        replace_file(tmpname, filename, backups)
+    monkeypatch.setattr(scratchlivedb.scratchdb, "_replace_file",
+                        _fail_second)
+    with pytest.raises(RuntimeError):
+        library.relocate("music", "Volumes/New/music")
+    assert replaced == [dbfile]
+    assert sorted(os.listdir(libdir)) == ["Subcrates", "database V2"]
+    assert sorted(os.listdir(os.path.join(libdir, "Subcrates"))) == [
+        "Alpha.crate", "Mid%%Sub.crate", "Zebra.crate"]
+    monkeypatch.undo()
+    library = scratchlivedb.SeratoLibrary(libdir, lazy=True)
+    assert library.database.relocate("Volumes/New/music", "music") == 50
+    library.database.save()
+
+    library = scratchlivedb.SeratoLibrary(libdir, lazy=True)
+    assert library.database.relocate("mus", "x") == 0
+    with pytest.raises(ValueError):
+        library.database.relocate("/", "x")
+    counts = library.relocate("music/", "Volumes/New/music/", backups=1)
+    assert counts[dbfile] == 50
+    assert sum(counts.values()) == 50 + 3 * 38
+    assert os.path.exists(dbfile + ".bak")
+
+    library = scratchlivedb.SeratoLibrary(libdir)
+    assert library.database.find_by_path("Volumes/New/" + oldpath)
+    assert library.crates["Zebra"].trackpaths[1] == (
+            "Volumes/New/" + oldpath)
+    assert library.database.relocate("/Volumes/New/music/", "/music/") == 50
+    assert library.database.entries[0].filebase == oldpath
+    assert library.database.relocate("Volumes/New", "") == 0
+    assert library.database.relocate("music", "Volumes/New/music") == 50
+    assert library.database.relocate("Volumes/New", "") == 50
+    assert library.database.entries[0].filebase == oldpath
+
+    # Prefixes match whole components, with or without a slash
+    rest = oldpath.split("/", 1)[1]
+    assert library.database.relocate("music/", "newroot") == 50
+    assert library.database.entries[0].filebase == "newroot/" + rest
+    assert library.database.relocate("newroot", "") == 50
+    assert library.database.entries[0].filebase == rest
+
+    # Paths stored decomposed, like on macOS, match a composed prefix
+    entry = library.database.entries[0]
+    entry.filebase = unicodedata.normalize("NFD", "Músic/a.mp3")
+    assert "Músic/a.mp3" in library.database
+    assert library.database.relocate("Músic", "x") == 1
+    assert entry.filebase == "x/a.mp3"
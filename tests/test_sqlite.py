@@ -0,0 +1,79 @@
+import os
+import sqlite3
+
+import scratchlivedb
+from scratchlivedb import sqlite
+
+datadir = os.path.join(os.path.dirname(__file__), "data")
+basicdb = os.path.join(datadir, "basic.db")
+unknowndb = os.path.join(datadir, "unknown_keys.db")
+testcratefile = os.path.join(datadir, "test.crate")
+
+
+def test_sqliteExport(tmp_path):
+    """
+    Export a DB and crate, check the content, and check that
+    re-exporting only syncs changes
+    """
+    sqlitefile = str(tmp_path / "library.sqlite")
+    db = scratchlivedb.ScratchDatabase(basicdb, lazy=True)
+    crate = scratchlivedb.ScratchCrate(testcratefile)
+
+    counts = sqlite.export_sqlite(sqlitefile, [db, crate])
+    assert counts == {"inserted": 97, "updated": 0,
+                      "deleted": 0, "unchanged": 0}
+
+    conn = sqlite3.connect(sqlitefile)
+    entry = db.entries[4]
+    row = conn.execute("SELECT tart, uadd, bmis, position FROM entries "
+                       "WHERE path = ?", (entry.filebase,)).fetchone()
+    assert row == (entry.trackartist, entry.inttimeadded,
+                   entry.boolmissing, 4)
+
+    counts = sqlite.export_sqlite(sqlitefile, [db, crate])
+    assert counts["unchanged"] == 97
+
+    entry.trackartist = "New artist"
+    del db.entries[0]
+    counts = sqlite.export_sqlite(sqlitefile, [db], batch_size=1)
+    assert counts == {"inserted": 0, "updated": 1,
+                      "deleted": 1, "unchanged": 48}
+    row = conn.execute("SELECT tart, position FROM entries "
+                       "WHERE path = ?", (entry.filebase,)).fetchone()
+    assert row == ("New artist", 3)
+    conn.close()
+
+
+def test_sqliteUnknownKeys(tmp_path):
+    """
+    Unknown fields are kept as raw bytes
+    """
+    sqlitefile = str(tmp_path / "library.sqlite")
+    db = scratchlivedb.ScratchDatabase(unknowndb)
+    sqlite.export_sqlite(sqlitefile, [db])
+
+    conn = sqlite3.connect(sqlitefile)
+    keys = [row[0] for row in conn.execute(
+            "SELECT DISTINCT key FROM entry_fields ORDER BY key")]
+    assert keys == ["tzzz", "uzzz", "zzzz"]
+    conn.close()
+
+
+def test_sqliteMalformedField(tmp_path):
+    """
+    Known fields that can't be decoded are kept as raw bytes
+    """
+    # pylint: disable=protected-access
+    # Ignore 'Access to protected member'
+    sqlitefile = str(tmp_path / "library.sqlite")
+    db = scratchlivedb.ScratchDatabase(basicdb, lazy=True)
+    db.entries[0]._set_raw("bmis", b"\x00\x01")
+    counts = sqlite.export_sqlite(sqlitefile, [db], batch_size=7)
+    assert counts["inserted"] == 50
+
+    conn = sqlite3.connect(sqlitefile)
+    assert conn.execute("SELECT key, value FROM entry_fields").fetchall() == [
+        ("bmis", b"\x00\x01")]
+    assert conn.execute("SELECT COUNT(*) FROM entries WHERE bmis IS NULL"
+                        ).fetchone()[0] == 1
+    conn.close()
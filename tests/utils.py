@@ -14,7 +14,7 @@ def do_run_cli(capsys, monkeypatch, argvstr, expectfail=False):
 
     ret = 0
     try:
-        _cli.main()
+        ret = _cli.main()
     except SystemExit as sys_e:
         ret = sys_e.code
 